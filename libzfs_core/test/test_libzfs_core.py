@@ -8,17 +8,22 @@ that the operations produce expected effects or fail with expected
 exceptions.
 """
 
+from __future__ import print_function
+
 import unittest
 import contextlib
+import ctypes
+import ctypes.util
 import errno
-import filecmp
+import fcntl
+import functools
 import os
 import platform
 import resource
 import shutil
-import stat
 import subprocess
 import tempfile
+import threading
 import time
 import uuid
 from .. import _libzfs_core as lzc
@@ -26,43 +31,130 @@ from .. import exceptions as lzc_exc
 
 
 def _print(*args):
-    for arg in args:
-        print arg,
-    print
+    print(*args)
 
 
-@contextlib.contextmanager
-def suppress(exceptions=None):
-    try:
-        yield
-    except BaseException as e:
-        if exceptions is None or isinstance(e, exceptions):
+try:
+    suppress = contextlib.suppress
+except AttributeError:
+    @contextlib.contextmanager
+    def suppress(*exceptions):
+        try:
+            yield
+        except exceptions:
             pass
-        else:
-            raise
 
 
-@contextlib.contextmanager
-def _zfs_mount(fs):
-    mntdir = tempfile.mkdtemp()
+def _mount_with_command(fs, mntdir):
     if platform.system() == 'SunOS':
         mount_cmd = ['mount', '-F', 'zfs', fs, mntdir]
     else:
         mount_cmd = ['mount', '-t', 'zfs', fs, mntdir]
-    unmount_cmd = ['umount', '-f', mntdir]
 
-    try:
-        subprocess.check_output(mount_cmd, stderr=subprocess.STDOUT)
+    # The output of the mount commands is not used, so it is discarded
+    # rather than read back through a pipe.
+    with open(os.devnull, 'wb') as devnull:
         try:
-            yield mntdir
-        finally:
-            with suppress():
-                subprocess.check_output(unmount_cmd, stderr=subprocess.STDOUT)
-    except subprocess.CalledProcessError as e:
-        print 'failed to mount %s @ %s : %s' % (fs, mntdir, e.output)
+            # errors from mount still go to stderr
+            subprocess.check_call(mount_cmd, stdout=devnull)
+        except subprocess.CalledProcessError:
+            print('failed to mount %s @ %s' % (fs, mntdir))
+            raise
+
+
+def _unmount_with_command(mntdir):
+    with open(os.devnull, 'wb') as devnull:
+        subprocess.check_call(
+            ['umount', '-f', mntdir], stdout=devnull, stderr=devnull)
+
+
+# On Linux the mount(2) and umount2(2) system calls are used directly
+# to avoid running the mount and umount programs for every mount.
+# The commands are still used if the C library can not be found.
+_MS_RDONLY = 1
+_MNT_FORCE = 1
+
+
+# ctypes passes text strings as wchar_t *, so the names are converted
+# to bytes first.
+def _to_bytes(s):
+    return s if isinstance(s, bytes) else s.encode()
+
+
+def _mount_with_syscall(fs, mntdir):
+    # snapshots can only be mounted read-only
+    flags = _MS_RDONLY if '@' in fs else 0
+    if _libc.mount(
+            _to_bytes(fs), _to_bytes(mntdir), b'zfs', flags, None) != 0:
+        err = ctypes.get_errno()
+        print('failed to mount %s @ %s' % (fs, mntdir))
+        raise OSError(err, os.strerror(err), mntdir)
+
+
+def _unmount_with_syscall(mntdir):
+    if _libc.umount2(_to_bytes(mntdir), _MNT_FORCE) != 0:
+        err = ctypes.get_errno()
+        raise OSError(err, os.strerror(err), mntdir)
+
+
+_libc_name = None
+if platform.system() == 'Linux':
+    _libc_name = ctypes.util.find_library('c')
+if _libc_name is not None:
+    _libc = ctypes.CDLL(_libc_name, use_errno=True)
+    _libc.mount.argtypes = [
+        ctypes.c_char_p, ctypes.c_char_p, ctypes.c_char_p, ctypes.c_ulong,
+        ctypes.c_void_p]
+    _libc.umount2.argtypes = [ctypes.c_char_p, ctypes.c_int]
+    _mount = _mount_with_syscall
+    _unmount = _unmount_with_syscall
+else:
+    _mount = _mount_with_command
+    _unmount = _unmount_with_command
+
+
+# Mountpoint directories are created under a common root and reused
+# by later mounts instead of being created and removed for every mount.
+# Nested mounts get different directories.
+_mnt_root = None
+_free_mntdirs = []
+
+
+def _get_mntdir():
+    global _mnt_root
+    if _free_mntdirs:
+        return _free_mntdirs.pop()
+    if _mnt_root is None:
+        _mnt_root = tempfile.mkdtemp(prefix='pyzfs-mnt-')
+    return tempfile.mkdtemp(dir=_mnt_root)
+
+
+def _remove_mntdirs():
+    global _mnt_root
+    del _free_mntdirs[:]
+    if _mnt_root is not None:
+        shutil.rmtree(_mnt_root, ignore_errors=True)
+        _mnt_root = None
+
+
+@contextlib.contextmanager
+def _zfs_mount(fs):
+    mntdir = _get_mntdir()
+    try:
+        _mount(fs, mntdir)
+    except BaseException:
+        _free_mntdirs.append(mntdir)
         raise
+    try:
+        yield mntdir
     finally:
-        os.rmdir(mntdir)
+        try:
+            _unmount(mntdir)
+        except BaseException:
+            # a directory that is still a mountpoint can not be reused
+            pass
+        else:
+            _free_mntdirs.append(mntdir)
 
 
 # XXX On illumos it is impossible to explicitly mount a snapshot.
@@ -124,37 +216,178 @@ def cleanup_fd():
         os.close(fd)
 
 
-@contextlib.contextmanager
-def os_open(name, mode):
-    fd = os.open(name, mode)
-    try:
-        yield fd
-    finally:
+# Descriptors of the device files are opened on first use and then
+# shared by all tests until _close_dev_fds() is called.
+_dev_fds = {}
+
+
+def _dev_fd(name, mode):
+    fd = _dev_fds.get(name)
+    if fd is None:
+        fd = _dev_fds[name] = os.open(name, mode)
+    return fd
+
+
+def _close_dev_fds():
+    for fd in _dev_fds.values():
         os.close(fd)
+    _dev_fds.clear()
 
 
 @contextlib.contextmanager
 def dev_null():
-    with os_open('/dev/null', os.O_WRONLY) as fd:
-        yield fd
+    yield _dev_fd('/dev/null', os.O_WRONLY)
 
 
 @contextlib.contextmanager
 def dev_zero():
-    with os_open('/dev/zero', os.O_RDONLY) as fd:
-        yield fd
+    yield _dev_fd('/dev/zero', os.O_RDONLY)
+
+
+# No file descriptor can be at or above the hard limit.
+_HARD_NOFILE = resource.getrlimit(resource.RLIMIT_NOFILE)[1]
 
 
+# Linux open() flag to create an unnamed file in the given directory.
+# The flag includes O_DIRECTORY, so kernels that do not support it
+# fail the open() instead of creating anything.
+# Python 2 does not provide the flag.  Its value differs between
+# architectures, so it is only hardcoded where the generic value
+# is known to apply.
+_GENERIC_O_TMPFILE_MACHINES = (
+    'x86', 'i386', 'i486', 'i586', 'i686', 'arm', 'aarch64')
+_O_TMPFILE = getattr(os, 'O_TMPFILE', None)
+if (_O_TMPFILE is None and platform.system() == 'Linux' and
+        platform.machine().startswith(_GENERIC_O_TMPFILE_MACHINES)):
+    _O_TMPFILE = 0o20200000
+
+
+# Stream files go to the temporary directory chosen by the user through
+# TMPDIR, TEMP or TMP.  Without one, memory-backed /dev/shm is preferred
+# when it is available.
+if (not any(os.environ.get(var) for var in ('TMPDIR', 'TEMP', 'TMP')) and
+        os.path.isdir('/dev/shm')):
+    _ZTREAM_DIR = '/dev/shm'
+else:
+    _ZTREAM_DIR = tempfile.gettempdir()
+
+
+# Create a temporary file for a send stream.
+# Where possible the file is created without a name, which saves
+# creating and removing the directory entry.
+def ztream():
+    global _O_TMPFILE
+    if _O_TMPFILE is not None:
+        try:
+            fd = os.open(_ZTREAM_DIR, _O_TMPFILE | os.O_RDWR, 0o600)
+        except OSError:
+            _O_TMPFILE = None
+        else:
+            return os.fdopen(fd, 'w+b')
+    return tempfile.TemporaryFile(suffix='.ztream', dir=_ZTREAM_DIR)
+
+
+# Linux fcntl() command to change the capacity of a pipe.
+_F_SETPIPE_SZ = 1031
+_PIPE_SIZE = 1024 * 1024
+
+
+# Produce the stream with lzc_send() in a separate thread and yield
+# the read end of a pipe, so that it can be passed to lzc_receive()
+# without storing the stream in a file.
+# The stream can be read only once, so the tests that need to replay
+# a stream still use temporary files.
 @contextlib.contextmanager
-def temp_file_in_fs(fs):
+def piped_stream(snap, fromsnap=None):
+    (rfd, wfd) = os.pipe()
+    if platform.system() == 'Linux':
+        # a larger pipe lets the sender run ahead of the receiver;
+        # the capacity can not be raised above the system limit
+        with suppress(IOError):
+            fcntl.fcntl(wfd, _F_SETPIPE_SZ, _PIPE_SIZE)
+    errors = []
+
+    def _send():
+        try:
+            lzc.lzc_send(snap, fromsnap, wfd)
+        except Exception as e:
+            errors.append(e)
+        finally:
+            os.close(wfd)
+
+    sender = threading.Thread(target=_send)
+    sender.daemon = True
+    sender.start()
+    try:
+        yield rfd
+    except Exception:
+        # If the send has already failed, the consumer only saw the stream
+        # cut short, so the send error is the one to report.  The read end
+        # is still open here, so the error is not caused by closing it.
+        if not sender.is_alive() and errors:
+            raise errors[0]
+        raise
+    finally:
+        os.close(rfd)
+        sender.join()
+    if errors:
+        raise errors[0]
+
+
+# Data written by the tests that need a known amount of space to be used.
+_ONE_MIB = b'x' * (1024 * 1024)
+
+
+# Take the snapshot while the filesystem contains a file with 1 MiB of data.
+# The file is removed afterwards, so the next snapshot sees it deleted.
+def snapshot_with_data(snap):
+    fs = snap.split('@')[0]
     with zfs_mount(fs) as mntdir:
         with tempfile.NamedTemporaryFile(dir=mntdir) as f:
-            for i in range(1024):
-                f.write('x' * 1024)
-            f.flush()
-            yield f.name
+            os.write(f.fileno(), _ONE_MIB)
+            lzc.lzc_snapshot([snap])
 
 
+# Size and contents of the files created by temp_file_in_fs.
+_TEMP_FILE_SIZE = 1024 * 1024
+_TEMP_FILE_DATA = b'\0' * (_TEMP_FILE_SIZE - 1) + b'x'
+
+
+@contextlib.contextmanager
+def temp_file_in_fs(fs):
+    with zfs_mount(fs) as mntdir:
+        (fd, name) = tempfile.mkstemp(dir=mntdir)
+        try:
+            # The file is sparse: only its last byte is written,
+            # so just a single block has to be allocated and synced.
+            # lzc_snapshot() syncs the pool's transaction group,
+            # so the data is captured by any snapshot taken afterwards
+            # without an explicit fsync.
+            os.ftruncate(fd, _TEMP_FILE_SIZE)
+            os.lseek(fd, _TEMP_FILE_SIZE - 1, os.SEEK_SET)
+            os.write(fd, b'x')
+            os.close(fd)
+            fd = None
+            yield name
+        finally:
+            if fd is not None:
+                os.close(fd)
+            os.unlink(name)
+
+
+# Check the contents of a file against the expected data.
+# The size is checked first, so a file of the wrong size is not read.
+def _file_contents_equal(path, data):
+    with open(path, 'rb') as f:
+        if os.fstat(f.fileno()).st_size != len(data):
+            return False
+        return f.read() == data
+
+
+# NB: the snapshots are taken one at a time on purpose.
+# They capture three different states of the same filesystem
+# and, besides, a single lzc_snapshot() call can not include
+# more than one snapshot of the same filesystem.
 def make_snapshots(fs, before, modified, after):
     def _maybe_snap(snap):
         if snap is not None:
@@ -174,11 +407,11 @@ def make_snapshots(fs, before, modified, after):
 @contextlib.contextmanager
 def streams(fs, first, second):
     (filename, snaps) = make_snapshots(fs, None, first, second)
-    with tempfile.TemporaryFile(suffix='.ztream') as full:
+    with ztream() as full:
         lzc.lzc_send(snaps[1], None, full.fileno())
         full.seek(0)
         if snaps[2] is not None:
-            with tempfile.TemporaryFile(suffix='.ztream') as incremental:
+            with ztream() as incremental:
                 lzc.lzc_send(snaps[2], snaps[1], incremental.fileno())
                 incremental.seek(0)
                 yield (filename, (full, incremental))
@@ -188,16 +421,42 @@ def streams(fs, first, second):
 
 def runtimeSkipIf(check_method, message):
     def _decorator(f):
+        @functools.wraps(f)
         def _f(_self, *args, **kwargs):
             if check_method(_self):
                 return _self.skipTest(message)
             else:
                 return f(_self, *args, **kwargs)
-        _f.__name__ = f.__name__
         return _f
     return _decorator
 
 
+# A test marked with this decorator does not modify any of the test pools,
+# so the expensive reset of the pools after the test can be skipped.
+# The reset is still done if the test fails, because a regression may
+# have left something behind.
+def no_mutation(f):
+    @functools.wraps(f)
+    def _f(_self, *args, **kwargs):
+        ret = f(_self, *args, **kwargs)
+        _self._no_mutation_passed = True
+        return ret
+    return _f
+
+
+# In a test marked with this decorator a successful create operation is
+# trusted to have created the dataset.  If ZFSTEST_FAST=1 is set in the
+# environment, assertExists() does nothing in the test, so the test only
+# checks that the operation does not fail.  assertNotExists() is still
+# checked.
+def assume_create_succeeds(f):
+    f.assume_create_succeeds = True
+    return f
+
+
+_FAST_TESTS = os.environ.get('ZFSTEST_FAST') == '1'
+
+
 def skipIfFeatureAvailable(feature, message):
     return runtimeSkipIf(lambda _self: _self.__class__.pool.isPoolFeatureAvailable(feature), message)
 
@@ -227,7 +486,22 @@ def needs_support(function):
                                '{} not available'.format(function.__name__))
 
 
-class ZFSTest(unittest.TestCase):
+class _ZFSTestCase(unittest.TestCase):
+
+    def assertExists(self, name):
+        if _FAST_TESTS:
+            test_method = getattr(self, self._testMethodName)
+            if getattr(test_method, 'assume_create_succeeds', False):
+                return
+        self.assertTrue(
+            lzc.lzc_exists(name), 'ZFS dataset %s does not exist' % (name, ))
+
+    def assertNotExists(self, name):
+        self.assertFalse(
+            lzc.lzc_exists(name), 'ZFS dataset %s exists' % (name, ))
+
+
+class ZFSTest(_ZFSTestCase):
     POOL_FILE_SIZE = 128 * 1024 * 1024
     FILESYSTEMS = ['fs1', 'fs2', 'fs1/fs']
 
@@ -237,15 +511,31 @@ class ZFSTest(unittest.TestCase):
 
     @classmethod
     def setUpClass(cls):
-        try:
-            cls.pool = _TempPool(filesystems=cls.FILESYSTEMS)
-            cls.misc_pool = _TempPool()
-            cls.readonly_pool = _TempPool(
-                filesystems=cls.FILESYSTEMS, readonly=True)
-            cls.pools = [cls.pool, cls.misc_pool, cls.readonly_pool]
-        except Exception:
+        # The pools are independent of each other, so they are created
+        # concurrently to cut down on the set up time.
+        pool_args = [
+            ('pool', dict(filesystems=cls.FILESYSTEMS)),
+            ('misc_pool', dict()),
+            ('readonly_pool', dict(filesystems=cls.FILESYSTEMS, readonly=True)),
+        ]
+        errors = []
+
+        def _create_pool(attr, kwargs):
+            try:
+                setattr(cls, attr, _TempPool(**kwargs))
+            except BaseException as e:
+                errors.append(e)
+
+        threads = [threading.Thread(target=_create_pool, args=args)
+                   for args in pool_args]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        if errors:
             cls._cleanUp()
-            raise
+            raise errors[0]
+        cls.pools = [cls.pool, cls.misc_pool, cls.readonly_pool]
 
     @classmethod
     def tearDownClass(cls):
@@ -256,37 +546,46 @@ class ZFSTest(unittest.TestCase):
         for pool in [cls.pool, cls.misc_pool, cls.readonly_pool]:
             if pool is not None:
                 pool.cleanUp()
+        _remove_mntdirs()
+        _close_dev_fds()
 
     def setUp(self):
-        pass
+        self._no_mutation_passed = False
 
     def tearDown(self):
+        if self._no_mutation_passed:
+            return
         for pool in ZFSTest.pools:
             pool.reset()
 
-    def assertExists(self, name):
-        self.assertTrue(
-            lzc.lzc_exists(name), 'ZFS dataset %s does not exist' % (name, ))
+    @classmethod
+    def _snap(cls):
+        return cls.pool.getRoot().getSnap()
 
-    def assertNotExists(self, name):
-        self.assertFalse(
-            lzc.lzc_exists(name), 'ZFS dataset %s exists' % (name, ))
+    @classmethod
+    def _fs(cls):
+        return cls.pool.getRoot().getFilesystem()
 
+    @no_mutation
     def test_exists(self):
         self.assertExists(ZFSTest.pool.makeName())
 
+    @no_mutation
     def test_exists_in_ro_pool(self):
         self.assertExists(ZFSTest.readonly_pool.makeName())
 
+    @no_mutation
     def test_exists_failure(self):
         self.assertNotExists(ZFSTest.pool.makeName('nonexistent'))
 
+    @assume_create_succeeds
     def test_create_fs(self):
         name = ZFSTest.pool.makeName("fs1/fs/test1")
 
         lzc.lzc_create(name)
         self.assertExists(name)
 
+    @assume_create_succeeds
     def test_create_zvol(self):
         name = ZFSTest.pool.makeName("fs1/fs/zvol")
         props = {"volsize": 1024 * 1024}
@@ -299,6 +598,7 @@ class ZFSTest(unittest.TestCase):
         # Because of that the post-test clean up could fail.
         time.sleep(0.1)
 
+    @assume_create_succeeds
     def test_create_fs_with_prop(self):
         name = ZFSTest.pool.makeName("fs1/fs/test2")
         props = {"atime": 0}
@@ -306,6 +606,7 @@ class ZFSTest(unittest.TestCase):
         lzc.lzc_create(name, props=props)
         self.assertExists(name)
 
+    @no_mutation
     def test_create_fs_wrong_ds_type(self):
         name = ZFSTest.pool.makeName("fs1/fs/test1")
 
@@ -329,12 +630,14 @@ class ZFSTest(unittest.TestCase):
         with self.assertRaises(lzc_exc.FilesystemExists):
             lzc.lzc_create(name)
 
+    @no_mutation
     def test_create_fs_in_ro_pool(self):
         name = ZFSTest.readonly_pool.makeName("fs")
 
         with self.assertRaises(lzc_exc.ReadOnlyPool):
             lzc.lzc_create(name)
 
+    @no_mutation
     def test_create_fs_without_parent(self):
         name = ZFSTest.pool.makeName("fs1/nonexistent/test")
 
@@ -342,13 +645,7 @@ class ZFSTest(unittest.TestCase):
             lzc.lzc_create(name)
         self.assertNotExists(name)
 
-    def test_create_fs_in_nonexistent_pool(self):
-        name = "no-such-pool/fs"
-
-        with self.assertRaises(lzc_exc.ParentNotFound):
-            lzc.lzc_create(name)
-        self.assertNotExists(name)
-
+    @no_mutation
     def test_create_fs_with_invalid_prop(self):
         name = ZFSTest.pool.makeName("fs1/fs/test3")
         props = {"BOGUS": 0}
@@ -357,6 +654,7 @@ class ZFSTest(unittest.TestCase):
             lzc.lzc_create(name, 'zfs', props)
         self.assertNotExists(name)
 
+    @no_mutation
     def test_create_fs_with_invalid_prop_type(self):
         name = ZFSTest.pool.makeName("fs1/fs/test4")
         props = {"recordsize": "128k"}
@@ -365,6 +663,7 @@ class ZFSTest(unittest.TestCase):
             lzc.lzc_create(name, 'zfs', props)
         self.assertNotExists(name)
 
+    @no_mutation
     def test_create_fs_with_invalid_prop_val(self):
         name = ZFSTest.pool.makeName("fs1/fs/test5")
         props = {"atime": 20}
@@ -373,6 +672,7 @@ class ZFSTest(unittest.TestCase):
             lzc.lzc_create(name, 'zfs', props)
         self.assertNotExists(name)
 
+    @no_mutation
     def test_create_fs_with_invalid_name(self):
         name = ZFSTest.pool.makeName("@badname")
 
@@ -380,13 +680,7 @@ class ZFSTest(unittest.TestCase):
             lzc.lzc_create(name)
         self.assertNotExists(name)
 
-    def test_create_fs_with_invalid_pool_name(self):
-        name = "bad!pool/fs"
-
-        with self.assertRaises(lzc_exc.NameInvalid):
-            lzc.lzc_create(name)
-        self.assertNotExists(name)
-
+    @assume_create_succeeds
     def test_snapshot(self):
         snapname = ZFSTest.pool.makeName("@snap")
         snaps = [snapname]
@@ -394,9 +688,7 @@ class ZFSTest(unittest.TestCase):
         lzc.lzc_snapshot(snaps)
         self.assertExists(snapname)
 
-    def test_snapshot_empty_list(self):
-        lzc.lzc_snapshot([])
-
+    @assume_create_succeeds
     def test_snapshot_user_props(self):
         snapname = ZFSTest.pool.makeName("@snap")
         snaps = [snapname]
@@ -405,6 +697,7 @@ class ZFSTest(unittest.TestCase):
         lzc.lzc_snapshot(snaps, props)
         self.assertExists(snapname)
 
+    @no_mutation
     def test_snapshot_invalid_props(self):
         snapname = ZFSTest.pool.makeName("@snap")
         snaps = [snapname]
@@ -413,11 +706,12 @@ class ZFSTest(unittest.TestCase):
         with self.assertRaises(lzc_exc.SnapshotFailure) as ctx:
             lzc.lzc_snapshot(snaps, props)
 
-        self.assertEquals(len(ctx.exception.errors), len(snaps))
+        self.assertEqual(len(ctx.exception.errors), len(snaps))
         for e in ctx.exception.errors:
             self.assertIsInstance(e, lzc_exc.PropertyInvalid)
         self.assertNotExists(snapname)
 
+    @no_mutation
     def test_snapshot_ro_pool(self):
         snapname1 = ZFSTest.readonly_pool.makeName("@snap")
         snapname2 = ZFSTest.readonly_pool.makeName("fs1@snap")
@@ -427,23 +721,13 @@ class ZFSTest(unittest.TestCase):
             lzc.lzc_snapshot(snaps)
 
         # NB: one common error is reported.
-        self.assertEquals(len(ctx.exception.errors), 1)
+        self.assertEqual(len(ctx.exception.errors), 1)
         for e in ctx.exception.errors:
             self.assertIsInstance(e, lzc_exc.ReadOnlyPool)
         self.assertNotExists(snapname1)
         self.assertNotExists(snapname2)
 
-    def test_snapshot_nonexistent_pool(self):
-        snapname = "no-such-pool@snap"
-        snaps = [snapname]
-
-        with self.assertRaises(lzc_exc.SnapshotFailure) as ctx:
-            lzc.lzc_snapshot(snaps)
-
-        self.assertEquals(len(ctx.exception.errors), 1)
-        for e in ctx.exception.errors:
-            self.assertIsInstance(e, lzc_exc.FilesystemNotFound)
-
+    @no_mutation
     def test_snapshot_nonexistent_fs(self):
         snapname = ZFSTest.pool.makeName("nonexistent@snap")
         snaps = [snapname]
@@ -451,10 +735,11 @@ class ZFSTest(unittest.TestCase):
         with self.assertRaises(lzc_exc.SnapshotFailure) as ctx:
             lzc.lzc_snapshot(snaps)
 
-        self.assertEquals(len(ctx.exception.errors), 1)
+        self.assertEqual(len(ctx.exception.errors), 1)
         for e in ctx.exception.errors:
             self.assertIsInstance(e, lzc_exc.FilesystemNotFound)
 
+    @no_mutation
     def test_snapshot_nonexistent_and_existent_fs(self):
         snapname1 = ZFSTest.pool.makeName("@snap")
         snapname2 = ZFSTest.pool.makeName("nonexistent@snap")
@@ -463,12 +748,13 @@ class ZFSTest(unittest.TestCase):
         with self.assertRaises(lzc_exc.SnapshotFailure) as ctx:
             lzc.lzc_snapshot(snaps)
 
-        self.assertEquals(len(ctx.exception.errors), 1)
+        self.assertEqual(len(ctx.exception.errors), 1)
         for e in ctx.exception.errors:
             self.assertIsInstance(e, lzc_exc.FilesystemNotFound)
         self.assertNotExists(snapname1)
         self.assertNotExists(snapname2)
 
+    @no_mutation
     def test_multiple_snapshots_nonexistent_fs(self):
         snapname1 = ZFSTest.pool.makeName("nonexistent@snap1")
         snapname2 = ZFSTest.pool.makeName("nonexistent@snap2")
@@ -478,12 +764,13 @@ class ZFSTest(unittest.TestCase):
             lzc.lzc_snapshot(snaps)
 
         # XXX two errors should be reported but alas
-        self.assertEquals(len(ctx.exception.errors), 1)
+        self.assertEqual(len(ctx.exception.errors), 1)
         for e in ctx.exception.errors:
             self.assertIsInstance(e, lzc_exc.FilesystemNotFound)
         self.assertNotExists(snapname1)
         self.assertNotExists(snapname2)
 
+    @no_mutation
     def test_multiple_snapshots_multiple_nonexistent_fs(self):
         snapname1 = ZFSTest.pool.makeName("nonexistent1@snap")
         snapname2 = ZFSTest.pool.makeName("nonexistent2@snap")
@@ -493,7 +780,7 @@ class ZFSTest(unittest.TestCase):
             lzc.lzc_snapshot(snaps)
 
         # XXX two errors should be reported but alas
-        self.assertEquals(len(ctx.exception.errors), 1)
+        self.assertEqual(len(ctx.exception.errors), 1)
         for e in ctx.exception.errors:
             self.assertIsInstance(e, lzc_exc.FilesystemNotFound)
         self.assertNotExists(snapname1)
@@ -508,10 +795,11 @@ class ZFSTest(unittest.TestCase):
         with self.assertRaises(lzc_exc.SnapshotFailure) as ctx:
             lzc.lzc_snapshot(snaps)
 
-        self.assertEquals(len(ctx.exception.errors), 1)
+        self.assertEqual(len(ctx.exception.errors), 1)
         for e in ctx.exception.errors:
             self.assertIsInstance(e, lzc_exc.SnapshotExists)
 
+    @no_mutation
     def test_multiple_snapshots_for_same_fs(self):
         snapname1 = ZFSTest.pool.makeName("@snap1")
         snapname2 = ZFSTest.pool.makeName("@snap2")
@@ -520,12 +808,13 @@ class ZFSTest(unittest.TestCase):
         with self.assertRaises(lzc_exc.SnapshotFailure) as ctx:
             lzc.lzc_snapshot(snaps)
 
-        self.assertEquals(len(ctx.exception.errors), 1)
+        self.assertEqual(len(ctx.exception.errors), 1)
         for e in ctx.exception.errors:
             self.assertIsInstance(e, lzc_exc.DuplicateSnapshots)
         self.assertNotExists(snapname1)
         self.assertNotExists(snapname2)
 
+    @assume_create_succeeds
     def test_multiple_snapshots(self):
         snapname1 = ZFSTest.pool.makeName("@snap")
         snapname2 = ZFSTest.pool.makeName("fs1@snap")
@@ -591,6 +880,7 @@ class ZFSTest(unittest.TestCase):
         self.assertNotExists(snapname2)
         self.assertNotExists(snapname3)
 
+    @no_mutation
     def test_snapshot_different_pools(self):
         snapname1 = ZFSTest.pool.makeName("@snap")
         snapname2 = ZFSTest.misc_pool.makeName("@snap")
@@ -600,12 +890,13 @@ class ZFSTest(unittest.TestCase):
             lzc.lzc_snapshot(snaps)
 
         # NB: one common error is reported.
-        self.assertEquals(len(ctx.exception.errors), 1)
+        self.assertEqual(len(ctx.exception.errors), 1)
         for e in ctx.exception.errors:
             self.assertIsInstance(e, lzc_exc.PoolsDiffer)
         self.assertNotExists(snapname1)
         self.assertNotExists(snapname2)
 
+    @no_mutation
     def test_snapshot_different_pools_ro_pool(self):
         snapname1 = ZFSTest.pool.makeName("@snap")
         snapname2 = ZFSTest.readonly_pool.makeName("@snap")
@@ -615,7 +906,7 @@ class ZFSTest(unittest.TestCase):
             lzc.lzc_snapshot(snaps)
 
         # NB: one common error is reported.
-        self.assertEquals(len(ctx.exception.errors), 1)
+        self.assertEqual(len(ctx.exception.errors), 1)
         for e in ctx.exception.errors:
             # NB: depending on whether the first attempted snapshot is
             # for the read-only pool a different error is reported.
@@ -624,6 +915,7 @@ class ZFSTest(unittest.TestCase):
         self.assertNotExists(snapname1)
         self.assertNotExists(snapname2)
 
+    @no_mutation
     def test_snapshot_invalid_name(self):
         snapname1 = ZFSTest.pool.makeName("@bad&name")
         snapname2 = ZFSTest.pool.makeName("fs1@bad*name")
@@ -634,11 +926,12 @@ class ZFSTest(unittest.TestCase):
             lzc.lzc_snapshot(snaps)
 
         # NB: one common error is reported.
-        self.assertEquals(len(ctx.exception.errors), 1)
+        self.assertEqual(len(ctx.exception.errors), 1)
         for e in ctx.exception.errors:
             self.assertIsInstance(e, lzc_exc.NameInvalid)
             self.assertIsNone(e.name)
 
+    @no_mutation
     def test_snapshot_too_long_complete_name(self):
         snapname1 = ZFSTest.pool.makeTooLongName("fs1@")
         snapname2 = ZFSTest.pool.makeTooLongName("fs2@")
@@ -648,11 +941,12 @@ class ZFSTest(unittest.TestCase):
         with self.assertRaises(lzc_exc.SnapshotFailure) as ctx:
             lzc.lzc_snapshot(snaps)
 
-        self.assertEquals(len(ctx.exception.errors), 2)
+        self.assertEqual(len(ctx.exception.errors), 2)
         for e in ctx.exception.errors:
             self.assertIsInstance(e, lzc_exc.NameTooLong)
             self.assertIsNotNone(e.name)
 
+    @no_mutation
     def test_snapshot_too_long_snap_name(self):
         snapname1 = ZFSTest.pool.makeTooLongComponent("fs1@")
         snapname2 = ZFSTest.pool.makeTooLongComponent("fs2@")
@@ -663,29 +957,18 @@ class ZFSTest(unittest.TestCase):
             lzc.lzc_snapshot(snaps)
 
         # NB: one common error is reported.
-        self.assertEquals(len(ctx.exception.errors), 1)
+        self.assertEqual(len(ctx.exception.errors), 1)
         for e in ctx.exception.errors:
             self.assertIsInstance(e, lzc_exc.NameTooLong)
             self.assertIsNone(e.name)
 
+    @no_mutation
     def test_destroy_nonexistent_snapshot(self):
         lzc.lzc_destroy_snaps([ZFSTest.pool.makeName("@nonexistent")], False)
         lzc.lzc_destroy_snaps([ZFSTest.pool.makeName("@nonexistent")], True)
 
-    def test_destroy_snapshot_of_nonexistent_pool(self):
-        with self.assertRaises(lzc_exc.SnapshotDestructionFailure) as ctx:
-            lzc.lzc_destroy_snaps(["no-such-pool@snap"], False)
-
-        for e in ctx.exception.errors:
-            self.assertIsInstance(e, lzc_exc.PoolNotFound)
-
-        with self.assertRaises(lzc_exc.SnapshotDestructionFailure) as ctx:
-            lzc.lzc_destroy_snaps(["no-such-pool@snap"], True)
-
-        for e in ctx.exception.errors:
-            self.assertIsInstance(e, lzc_exc.PoolNotFound)
-
     # NB: note the difference from the nonexistent pool test.
+    @no_mutation
     def test_destroy_snapshot_of_nonexistent_fs(self):
         lzc.lzc_destroy_snaps(
             [ZFSTest.pool.makeName("nonexistent@snap")], False)
@@ -713,6 +996,7 @@ class ZFSTest(unittest.TestCase):
         with self.assertRaises(lzc_exc.SnapshotDestructionFailure):
             lzc.lzc_destroy_snaps(snaps, True)
 
+    @no_mutation
     def test_destroy_too_long_short_snap_name(self):
         snapname1 = ZFSTest.pool.makeTooLongComponent("fs1@")
         snapname2 = ZFSTest.pool.makeTooLongComponent("fs2@")
@@ -727,7 +1011,7 @@ class ZFSTest(unittest.TestCase):
 
     @unittest.skipUnless(*snap_always_unmounted_before_destruction())
     def test_destroy_mounted_snap(self):
-        snap = ZFSTest.pool.getRoot().getSnap()
+        snap = self._snap()
 
         lzc.lzc_snapshot([snap])
         with zfs_mount(snap):
@@ -735,6 +1019,7 @@ class ZFSTest(unittest.TestCase):
             lzc.lzc_destroy_snaps([snap], defer=False)
             self.assertNotExists(snap)
 
+    @assume_create_succeeds
     def test_clone(self):
         # NB: note the special name for the snapshot.
         # Since currently we can not destroy filesystems,
@@ -748,6 +1033,7 @@ class ZFSTest(unittest.TestCase):
         lzc.lzc_clone(name, snapname)
         self.assertExists(name)
 
+    @no_mutation
     def test_clone_nonexistent_snapshot(self):
         snapname = ZFSTest.pool.makeName("fs2@nonexistent")
         name = ZFSTest.pool.makeName("fs1/fs/clone2")
@@ -779,6 +1065,7 @@ class ZFSTest(unittest.TestCase):
             lzc.lzc_clone(name, snapname)
         self.assertNotExists(name)
 
+    @no_mutation
     def test_clone_invalid_snap_name(self):
         # Use a valid filesystem name of filesystem that
         # exists as a snapshot name
@@ -789,6 +1076,7 @@ class ZFSTest(unittest.TestCase):
             lzc.lzc_clone(name, snapname)
         self.assertNotExists(name)
 
+    @no_mutation
     def test_clone_invalid_snap_name_2(self):
         # Use a valid filesystem name of filesystem that
         # doesn't exist as a snapshot name
@@ -852,7 +1140,7 @@ class ZFSTest(unittest.TestCase):
         with self.assertRaises(lzc_exc.SnapshotDestructionFailure) as ctx:
             lzc.lzc_destroy_snaps(snaps, False)
 
-        self.assertEquals(len(ctx.exception.errors), 1)
+        self.assertEqual(len(ctx.exception.errors), 1)
         for e in ctx.exception.errors:
             self.assertIsInstance(e, lzc_exc.SnapshotIsCloned)
         for snap in snaps:
@@ -890,24 +1178,28 @@ class ZFSTest(unittest.TestCase):
         ret = lzc.lzc_rollback(name)
         self.assertEqual(ret, snapname2)
 
+    @no_mutation
     def test_rollback_no_snaps(self):
         name = ZFSTest.pool.makeName("fs1")
 
         with self.assertRaises(lzc_exc.SnapshotNotFound):
             lzc.lzc_rollback(name)
 
+    @no_mutation
     def test_rollback_non_existent_fs(self):
         name = ZFSTest.pool.makeName("nonexistent")
 
         with self.assertRaises(lzc_exc.FilesystemNotFound):
             lzc.lzc_rollback(name)
 
+    @no_mutation
     def test_rollback_invalid_fs_name(self):
         name = ZFSTest.pool.makeName("bad~name")
 
         with self.assertRaises(lzc_exc.NameInvalid):
             lzc.lzc_rollback(name)
 
+    @no_mutation
     def test_rollback_snap_name(self):
         name = ZFSTest.pool.makeName("fs1@snap")
 
@@ -921,103 +1213,74 @@ class ZFSTest(unittest.TestCase):
         with self.assertRaises(lzc_exc.NameInvalid):
             lzc.lzc_rollback(name)
 
+    @no_mutation
     def test_rollback_too_long_fs_name(self):
         name = ZFSTest.pool.makeTooLongName()
 
         with self.assertRaises(lzc_exc.NameTooLong):
             lzc.lzc_rollback(name)
 
-    @skipUnlessBookmarksSupported
-    def test_bookmarks(self):
-        snaps = [ZFSTest.pool.makeName(
-            'fs1@snap1'), ZFSTest.pool.makeName('fs2@snap1')]
-        bmarks = [ZFSTest.pool.makeName(
-            'fs1#bmark1'), ZFSTest.pool.makeName('fs2#bmark1')]
-        bmark_dict = {x: y for x, y in zip(bmarks, snaps)}
-
-        lzc.lzc_snapshot(snaps)
-        lzc.lzc_bookmark(bmark_dict)
-
     @skipUnlessBookmarksSupported
     def test_bookmarks_2(self):
         snaps = [ZFSTest.pool.makeName(
             'fs1@snap1'), ZFSTest.pool.makeName('fs2@snap1')]
         bmarks = [ZFSTest.pool.makeName(
             'fs1#bmark1'), ZFSTest.pool.makeName('fs2#bmark1')]
-        bmark_dict = {x: y for x, y in zip(bmarks, snaps)}
+        bmark_dict = dict(zip(bmarks, snaps))
 
         lzc.lzc_snapshot(snaps)
         lzc.lzc_bookmark(bmark_dict)
         lzc.lzc_destroy_snaps(snaps, defer=False)
 
+    @no_mutation
     @skipUnlessBookmarksSupported
     def test_bookmarks_empty(self):
         lzc.lzc_bookmark({})
 
-    @skipUnlessBookmarksSupported
-    def test_bookmarks_mismatching_name(self):
-        snaps = [ZFSTest.pool.makeName('fs1@snap1')]
-        bmarks = [ZFSTest.pool.makeName('fs2#bmark1')]
-        bmark_dict = {x: y for x, y in zip(bmarks, snaps)}
+    def _assertBookmarkFailure(self, bmarks, snaps, error):
+        bmark_dict = dict(zip(bmarks, snaps))
 
         lzc.lzc_snapshot(snaps)
         with self.assertRaises(lzc_exc.BookmarkFailure) as ctx:
             lzc.lzc_bookmark(bmark_dict)
 
         for e in ctx.exception.errors:
-            self.assertIsInstance(e, lzc_exc.BookmarkMismatch)
+            self.assertIsInstance(e, error)
+
+    @skipUnlessBookmarksSupported
+    def test_bookmarks_mismatching_name(self):
+        snaps = [ZFSTest.pool.makeName('fs1@snap1')]
+        bmarks = [ZFSTest.pool.makeName('fs2#bmark1')]
+
+        self._assertBookmarkFailure(bmarks, snaps, lzc_exc.BookmarkMismatch)
 
     @skipUnlessBookmarksSupported
     def test_bookmarks_invalid_name(self):
         snaps = [ZFSTest.pool.makeName('fs1@snap1')]
         bmarks = [ZFSTest.pool.makeName('fs1#bmark!')]
-        bmark_dict = {x: y for x, y in zip(bmarks, snaps)}
 
-        lzc.lzc_snapshot(snaps)
-        with self.assertRaises(lzc_exc.BookmarkFailure) as ctx:
-            lzc.lzc_bookmark(bmark_dict)
-
-        for e in ctx.exception.errors:
-            self.assertIsInstance(e, lzc_exc.NameInvalid)
+        self._assertBookmarkFailure(bmarks, snaps, lzc_exc.NameInvalid)
 
     @skipUnlessBookmarksSupported
     def test_bookmarks_invalid_name_2(self):
         snaps = [ZFSTest.pool.makeName('fs1@snap1')]
         bmarks = [ZFSTest.pool.makeName('fs1@bmark')]
-        bmark_dict = {x: y for x, y in zip(bmarks, snaps)}
-
-        lzc.lzc_snapshot(snaps)
-        with self.assertRaises(lzc_exc.BookmarkFailure) as ctx:
-            lzc.lzc_bookmark(bmark_dict)
 
-        for e in ctx.exception.errors:
-            self.assertIsInstance(e, lzc_exc.NameInvalid)
+        self._assertBookmarkFailure(bmarks, snaps, lzc_exc.NameInvalid)
 
     @skipUnlessBookmarksSupported
     def test_bookmarks_too_long_name(self):
         snaps = [ZFSTest.pool.makeName('fs1@snap1')]
         bmarks = [ZFSTest.pool.makeTooLongName('fs1#')]
-        bmark_dict = {x: y for x, y in zip(bmarks, snaps)}
-
-        lzc.lzc_snapshot(snaps)
-        with self.assertRaises(lzc_exc.BookmarkFailure) as ctx:
-            lzc.lzc_bookmark(bmark_dict)
 
-        for e in ctx.exception.errors:
-            self.assertIsInstance(e, lzc_exc.NameTooLong)
+        self._assertBookmarkFailure(bmarks, snaps, lzc_exc.NameTooLong)
 
     @skipUnlessBookmarksSupported
     def test_bookmarks_too_long_name_2(self):
         snaps = [ZFSTest.pool.makeName('fs1@snap1')]
         bmarks = [ZFSTest.pool.makeTooLongComponent('fs1#')]
-        bmark_dict = {x: y for x, y in zip(bmarks, snaps)}
 
-        lzc.lzc_snapshot(snaps)
-        with self.assertRaises(lzc_exc.BookmarkFailure) as ctx:
-            lzc.lzc_bookmark(bmark_dict)
-
-        for e in ctx.exception.errors:
-            self.assertIsInstance(e, lzc_exc.NameTooLong)
+        self._assertBookmarkFailure(bmarks, snaps, lzc_exc.NameTooLong)
 
     @skipUnlessBookmarksSupported
     def test_bookmarks_mismatching_names(self):
@@ -1025,14 +1288,8 @@ class ZFSTest(unittest.TestCase):
             'fs1@snap1'), ZFSTest.pool.makeName('fs2@snap1')]
         bmarks = [ZFSTest.pool.makeName(
             'fs2#bmark1'), ZFSTest.pool.makeName('fs1#bmark1')]
-        bmark_dict = {x: y for x, y in zip(bmarks, snaps)}
 
-        lzc.lzc_snapshot(snaps)
-        with self.assertRaises(lzc_exc.BookmarkFailure) as ctx:
-            lzc.lzc_bookmark(bmark_dict)
-
-        for e in ctx.exception.errors:
-            self.assertIsInstance(e, lzc_exc.BookmarkMismatch)
+        self._assertBookmarkFailure(bmarks, snaps, lzc_exc.BookmarkMismatch)
 
     @skipUnlessBookmarksSupported
     def test_bookmarks_partially_mismatching_names(self):
@@ -1040,14 +1297,8 @@ class ZFSTest(unittest.TestCase):
             'fs1@snap1'), ZFSTest.pool.makeName('fs2@snap1')]
         bmarks = [ZFSTest.pool.makeName(
             'fs2#bmark'), ZFSTest.pool.makeName('fs2#bmark1')]
-        bmark_dict = {x: y for x, y in zip(bmarks, snaps)}
-
-        lzc.lzc_snapshot(snaps)
-        with self.assertRaises(lzc_exc.BookmarkFailure) as ctx:
-            lzc.lzc_bookmark(bmark_dict)
 
-        for e in ctx.exception.errors:
-            self.assertIsInstance(e, lzc_exc.BookmarkMismatch)
+        self._assertBookmarkFailure(bmarks, snaps, lzc_exc.BookmarkMismatch)
 
     @skipUnlessBookmarksSupported
     def test_bookmarks_cross_pool(self):
@@ -1055,7 +1306,7 @@ class ZFSTest(unittest.TestCase):
             'fs1@snap1'), ZFSTest.misc_pool.makeName('@snap1')]
         bmarks = [ZFSTest.pool.makeName(
             'fs1#bmark1'), ZFSTest.misc_pool.makeName('#bmark1')]
-        bmark_dict = {x: y for x, y in zip(bmarks, snaps)}
+        bmark_dict = dict(zip(bmarks, snaps))
 
         lzc.lzc_snapshot(snaps[0:1])
         lzc.lzc_snapshot(snaps[1:2])
@@ -1071,7 +1322,7 @@ class ZFSTest(unittest.TestCase):
             'fs1@snap1'), ZFSTest.pool.makeName('fs2@snap1')]
         bmarks = [ZFSTest.pool.makeName(
             'fs1#bmark1'), ZFSTest.pool.makeName('fs2#bmark1')]
-        bmark_dict = {x: y for x, y in zip(bmarks, snaps)}
+        bmark_dict = dict(zip(bmarks, snaps))
 
         lzc.lzc_snapshot(snaps[0:1])
         with self.assertRaises(lzc_exc.BookmarkFailure) as ctx:
@@ -1086,7 +1337,7 @@ class ZFSTest(unittest.TestCase):
             'fs1@snap1'), ZFSTest.pool.makeName('fs2@snap1')]
         bmarks = [ZFSTest.pool.makeName(
             'fs1#bmark1'), ZFSTest.pool.makeName('fs2#bmark1')]
-        bmark_dict = {x: y for x, y in zip(bmarks, snaps)}
+        bmark_dict = dict(zip(bmarks, snaps))
 
         with self.assertRaises(lzc_exc.BookmarkFailure) as ctx:
             lzc.lzc_bookmark(bmark_dict)
@@ -1150,19 +1401,19 @@ class ZFSTest(unittest.TestCase):
         lzc.lzc_destroy_snaps([snap1, snap2], defer=False)
 
         bmarks = lzc.lzc_get_bookmarks(ZFSTest.pool.makeName('fs1'))
-        self.assertEquals(len(bmarks), 3)
+        self.assertEqual(len(bmarks), 3)
         for b in 'bmark', 'bmark1', 'bmark2':
             self.assertIn(b, bmarks)
             self.assertIsInstance(bmarks[b], dict)
-            self.assertEquals(len(bmarks[b]), 0)
+            self.assertEqual(len(bmarks[b]), 0)
 
         bmarks = lzc.lzc_get_bookmarks(
             ZFSTest.pool.makeName('fs1'), ['guid', 'createtxg', 'creation'])
-        self.assertEquals(len(bmarks), 3)
+        self.assertEqual(len(bmarks), 3)
         for b in 'bmark', 'bmark1', 'bmark2':
             self.assertIn(b, bmarks)
             self.assertIsInstance(bmarks[b], dict)
-            self.assertEquals(len(bmarks[b]), 3)
+            self.assertEqual(len(bmarks[b]), 3)
 
     @skipUnlessBookmarksSupported
     def test_get_bookmarks_invalid_property(self):
@@ -1175,12 +1426,13 @@ class ZFSTest(unittest.TestCase):
 
         bmarks = lzc.lzc_get_bookmarks(
             ZFSTest.pool.makeName('fs1'), ['badprop'])
-        self.assertEquals(len(bmarks), 1)
+        self.assertEqual(len(bmarks), 1)
         for b in ('bmark', ):
             self.assertIn(b, bmarks)
             self.assertIsInstance(bmarks[b], dict)
-            self.assertEquals(len(bmarks[b]), 0)
+            self.assertEqual(len(bmarks[b]), 0)
 
+    @no_mutation
     @skipUnlessBookmarksSupported
     def test_get_bookmarks_nonexistent_fs(self):
         with self.assertRaises(lzc_exc.FilesystemNotFound):
@@ -1198,7 +1450,7 @@ class ZFSTest(unittest.TestCase):
         lzc.lzc_destroy_bookmarks(
             [bmark, ZFSTest.pool.makeName('fs1#nonexistent')])
         bmarks = lzc.lzc_get_bookmarks(ZFSTest.pool.makeName('fs1'))
-        self.assertEquals(len(bmarks), 0)
+        self.assertEqual(len(bmarks), 0)
 
     @skipUnlessBookmarksSupported
     def test_destroy_bookmarks_invalid_name(self):
@@ -1216,13 +1468,15 @@ class ZFSTest(unittest.TestCase):
             self.assertIsInstance(e, lzc_exc.NameInvalid)
 
         bmarks = lzc.lzc_get_bookmarks(ZFSTest.pool.makeName('fs1'))
-        self.assertEquals(len(bmarks), 1)
+        self.assertEqual(len(bmarks), 1)
         self.assertIn('bmark', bmarks)
 
+    @no_mutation
     @skipUnlessBookmarksSupported
     def test_destroy_bookmark_nonexistent_fs(self):
         lzc.lzc_destroy_bookmarks([ZFSTest.pool.makeName('nonexistent#bmark')])
 
+    @no_mutation
     @skipUnlessBookmarksSupported
     def test_destroy_bookmarks_empty(self):
         lzc.lzc_bookmark({})
@@ -1249,12 +1503,7 @@ class ZFSTest(unittest.TestCase):
         snap3 = ZFSTest.pool.makeName("fs1@snap")
 
         lzc.lzc_snapshot([snap1])
-        with zfs_mount(ZFSTest.pool.makeName("fs1")) as mntdir:
-            with tempfile.NamedTemporaryFile(dir=mntdir) as f:
-                for i in range(1024):
-                    f.write('x' * 1024)
-                f.flush()
-                lzc.lzc_snapshot([snap2])
+        snapshot_with_data(snap2)
         lzc.lzc_snapshot([snap3])
 
         space = lzc.lzc_snaprange_space(snap1, snap2)
@@ -1267,12 +1516,7 @@ class ZFSTest(unittest.TestCase):
     def test_snaprange_space_same_snap(self):
         snap = ZFSTest.pool.makeName("fs1@snap")
 
-        with zfs_mount(ZFSTest.pool.makeName("fs1")) as mntdir:
-            with tempfile.NamedTemporaryFile(dir=mntdir) as f:
-                for i in range(1024):
-                    f.write('x' * 1024)
-                f.flush()
-                lzc.lzc_snapshot([snap])
+        snapshot_with_data(snap)
 
         space = lzc.lzc_snaprange_space(snap, snap)
         self.assertGreater(space, 1024 * 1024)
@@ -1292,8 +1536,7 @@ class ZFSTest(unittest.TestCase):
         snap1 = ZFSTest.pool.makeName("fs1@snap1")
         snap2 = ZFSTest.pool.makeName("fs2@snap2")
 
-        lzc.lzc_snapshot([snap1])
-        lzc.lzc_snapshot([snap2])
+        lzc.lzc_snapshot([snap1, snap2])
 
         with self.assertRaises(lzc_exc.SnapshotMismatch):
             lzc.lzc_snaprange_space(snap1, snap2)
@@ -1316,11 +1559,11 @@ class ZFSTest(unittest.TestCase):
 
         with self.assertRaises(lzc_exc.SnapshotNotFound) as ctx:
             lzc.lzc_snaprange_space(snap1, snap2)
-        self.assertEquals(ctx.exception.name, snap2)
+        self.assertEqual(ctx.exception.name, snap2)
 
         with self.assertRaises(lzc_exc.SnapshotNotFound) as ctx:
             lzc.lzc_snaprange_space(snap2, snap1)
-        self.assertEquals(ctx.exception.name, snap1)
+        self.assertEqual(ctx.exception.name, snap1)
 
     def test_snaprange_space_invalid_name(self):
         snap1 = ZFSTest.pool.makeName("fs1@snap1")
@@ -1381,12 +1624,7 @@ class ZFSTest(unittest.TestCase):
         snap3 = ZFSTest.pool.makeName("fs1@snap")
 
         lzc.lzc_snapshot([snap1])
-        with zfs_mount(ZFSTest.pool.makeName("fs1")) as mntdir:
-            with tempfile.NamedTemporaryFile(dir=mntdir) as f:
-                for i in range(1024):
-                    f.write('x' * 1024)
-                f.flush()
-                lzc.lzc_snapshot([snap2])
+        snapshot_with_data(snap2)
         lzc.lzc_snapshot([snap3])
 
         space = lzc.lzc_send_space(snap2, snap1)
@@ -1402,7 +1640,7 @@ class ZFSTest(unittest.TestCase):
         self.assertGreater(space, 1024 * 1024)
 
         space = lzc.lzc_send_space(snap3)
-        self.assertEquals(space, space_empty)
+        self.assertEqual(space, space_empty)
 
     def test_send_space_same_snap(self):
         snap1 = ZFSTest.pool.makeName("fs1@snap1")
@@ -1424,8 +1662,7 @@ class ZFSTest(unittest.TestCase):
         snap1 = ZFSTest.pool.makeName("fs1@snap1")
         snap2 = ZFSTest.pool.makeName("fs2@snap2")
 
-        lzc.lzc_snapshot([snap1])
-        lzc.lzc_snapshot([snap2])
+        lzc.lzc_snapshot([snap1, snap2])
 
         with self.assertRaises(lzc_exc.SnapshotMismatch):
             lzc.lzc_send_space(snap1, snap2)
@@ -1448,15 +1685,15 @@ class ZFSTest(unittest.TestCase):
 
         with self.assertRaises(lzc_exc.SnapshotNotFound) as ctx:
             lzc.lzc_send_space(snap1, snap2)
-        self.assertEquals(ctx.exception.name, snap1)
+        self.assertEqual(ctx.exception.name, snap1)
 
         with self.assertRaises(lzc_exc.SnapshotNotFound) as ctx:
             lzc.lzc_send_space(snap2, snap1)
-        self.assertEquals(ctx.exception.name, snap2)
+        self.assertEqual(ctx.exception.name, snap2)
 
         with self.assertRaises(lzc_exc.SnapshotNotFound) as ctx:
             lzc.lzc_send_space(snap2)
-        self.assertEquals(ctx.exception.name, snap2)
+        self.assertEqual(ctx.exception.name, snap2)
 
     def test_send_space_invalid_name(self):
         snap1 = ZFSTest.pool.makeName("fs1@snap1")
@@ -1466,13 +1703,13 @@ class ZFSTest(unittest.TestCase):
 
         with self.assertRaises(lzc_exc.NameInvalid) as ctx:
             lzc.lzc_send_space(snap2, snap1)
-        self.assertEquals(ctx.exception.name, snap2)
+        self.assertEqual(ctx.exception.name, snap2)
         with self.assertRaises(lzc_exc.NameInvalid) as ctx:
             lzc.lzc_send_space(snap2)
-        self.assertEquals(ctx.exception.name, snap2)
+        self.assertEqual(ctx.exception.name, snap2)
         with self.assertRaises(lzc_exc.NameInvalid) as ctx:
             lzc.lzc_send_space(snap1, snap2)
-        self.assertEquals(ctx.exception.name, snap2)
+        self.assertEqual(ctx.exception.name, snap2)
 
     def test_send_space_not_snap(self):
         snap1 = ZFSTest.pool.makeName("fs1@snap1")
@@ -1501,14 +1738,9 @@ class ZFSTest(unittest.TestCase):
     def test_send_full(self):
         snap = ZFSTest.pool.makeName("fs1@snap")
 
-        with zfs_mount(ZFSTest.pool.makeName("fs1")) as mntdir:
-            with tempfile.NamedTemporaryFile(dir=mntdir) as f:
-                for i in range(1024):
-                    f.write('x' * 1024)
-                f.flush()
-                lzc.lzc_snapshot([snap])
+        snapshot_with_data(snap)
 
-        with tempfile.TemporaryFile(suffix='.ztream') as output:
+        with ztream() as output:
             estimate = lzc.lzc_send_space(snap)
 
             fd = output.fileno()
@@ -1522,14 +1754,9 @@ class ZFSTest(unittest.TestCase):
         snap2 = ZFSTest.pool.makeName("fs1@snap2")
 
         lzc.lzc_snapshot([snap1])
-        with zfs_mount(ZFSTest.pool.makeName("fs1")) as mntdir:
-            with tempfile.NamedTemporaryFile(dir=mntdir) as f:
-                for i in range(1024):
-                    f.write('x' * 1024)
-                f.flush()
-                lzc.lzc_snapshot([snap2])
+        snapshot_with_data(snap2)
 
-        with tempfile.TemporaryFile(suffix='.ztream') as output:
+        with ztream() as output:
             estimate = lzc.lzc_send_space(snap2, snap1)
 
             fd = output.fileno()
@@ -1556,8 +1783,7 @@ class ZFSTest(unittest.TestCase):
     def test_send_same_snap(self):
         snap1 = ZFSTest.pool.makeName("fs1@snap1")
         lzc.lzc_snapshot([snap1])
-        with tempfile.TemporaryFile(suffix='.ztream') as output:
-            fd = output.fileno()
+        with dev_null() as fd:
             with self.assertRaises(lzc_exc.SnapshotMismatch):
                 lzc.lzc_send(snap1, snap1, fd)
 
@@ -1568,8 +1794,7 @@ class ZFSTest(unittest.TestCase):
         lzc.lzc_snapshot([snap1])
         lzc.lzc_snapshot([snap2])
 
-        with tempfile.TemporaryFile(suffix='.ztream') as output:
-            fd = output.fileno()
+        with dev_null() as fd:
             with self.assertRaises(lzc_exc.SnapshotMismatch):
                 lzc.lzc_send(snap1, snap2, fd)
 
@@ -1577,11 +1802,9 @@ class ZFSTest(unittest.TestCase):
         snap1 = ZFSTest.pool.makeName("fs1@snap1")
         snap2 = ZFSTest.pool.makeName("fs2@snap2")
 
-        lzc.lzc_snapshot([snap1])
-        lzc.lzc_snapshot([snap2])
+        lzc.lzc_snapshot([snap1, snap2])
 
-        with tempfile.TemporaryFile(suffix='.ztream') as output:
-            fd = output.fileno()
+        with dev_null() as fd:
             with self.assertRaises(lzc_exc.SnapshotMismatch):
                 lzc.lzc_send(snap1, snap2, fd)
 
@@ -1592,8 +1815,7 @@ class ZFSTest(unittest.TestCase):
         lzc.lzc_snapshot([snap1])
         lzc.lzc_snapshot([snap2])
 
-        with tempfile.TemporaryFile(suffix='.ztream') as output:
-            fd = output.fileno()
+        with dev_null() as fd:
             with self.assertRaises(lzc_exc.PoolsDiffer):
                 lzc.lzc_send(snap1, snap2, fd)
 
@@ -1603,19 +1825,18 @@ class ZFSTest(unittest.TestCase):
 
         lzc.lzc_snapshot([snap1])
 
-        with tempfile.TemporaryFile(suffix='.ztream') as output:
-            fd = output.fileno()
+        with dev_null() as fd:
             with self.assertRaises(lzc_exc.SnapshotNotFound) as ctx:
                 lzc.lzc_send(snap1, snap2, fd)
-            self.assertEquals(ctx.exception.name, snap1)
+            self.assertEqual(ctx.exception.name, snap1)
 
             with self.assertRaises(lzc_exc.SnapshotNotFound) as ctx:
                 lzc.lzc_send(snap2, snap1, fd)
-            self.assertEquals(ctx.exception.name, snap2)
+            self.assertEqual(ctx.exception.name, snap2)
 
             with self.assertRaises(lzc_exc.SnapshotNotFound) as ctx:
                 lzc.lzc_send(snap2, None, fd)
-            self.assertEquals(ctx.exception.name, snap2)
+            self.assertEqual(ctx.exception.name, snap2)
 
     def test_send_invalid_name(self):
         snap1 = ZFSTest.pool.makeName("fs1@snap1")
@@ -1623,17 +1844,16 @@ class ZFSTest(unittest.TestCase):
 
         lzc.lzc_snapshot([snap1])
 
-        with tempfile.TemporaryFile(suffix='.ztream') as output:
-            fd = output.fileno()
+        with dev_null() as fd:
             with self.assertRaises(lzc_exc.NameInvalid) as ctx:
                 lzc.lzc_send(snap2, snap1, fd)
-            self.assertEquals(ctx.exception.name, snap2)
+            self.assertEqual(ctx.exception.name, snap2)
             with self.assertRaises(lzc_exc.NameInvalid) as ctx:
                 lzc.lzc_send(snap2, None, fd)
-            self.assertEquals(ctx.exception.name, snap2)
+            self.assertEqual(ctx.exception.name, snap2)
             with self.assertRaises(lzc_exc.NameInvalid) as ctx:
                 lzc.lzc_send(snap1, snap2, fd)
-            self.assertEquals(ctx.exception.name, snap2)
+            self.assertEqual(ctx.exception.name, snap2)
 
     # XXX Although undocumented the API allows to create an incremental
     # or full stream for a filesystem as if a temporary unnamed snapshot
@@ -1645,7 +1865,7 @@ class ZFSTest(unittest.TestCase):
 
         lzc.lzc_snapshot([snap])
 
-        with tempfile.TemporaryFile(suffix='.ztream') as output:
+        with ztream() as output:
             fd = output.fileno()
             lzc.lzc_send(fs, snap, fd)
             lzc.lzc_send(fs, None, fd)
@@ -1656,8 +1876,7 @@ class ZFSTest(unittest.TestCase):
 
         lzc.lzc_snapshot([snap])
 
-        with tempfile.TemporaryFile(suffix='.ztream') as output:
-            fd = output.fileno()
+        with dev_null() as fd:
             with self.assertRaises(lzc_exc.NameInvalid):
                 lzc.lzc_send(snap, fs, fd)
 
@@ -1672,8 +1891,7 @@ class ZFSTest(unittest.TestCase):
         lzc.lzc_bookmark({bmark: snap2})
         lzc.lzc_destroy_snaps([snap2], defer=False)
 
-        with tempfile.TemporaryFile(suffix='.ztream') as output:
-            fd = output.fileno()
+        with dev_null() as fd:
             with self.assertRaises(lzc_exc.NameInvalid):
                 lzc.lzc_send(bmark, snap1, fd)
             with self.assertRaises(lzc_exc.NameInvalid):
@@ -1690,7 +1908,7 @@ class ZFSTest(unittest.TestCase):
         lzc.lzc_bookmark({bmark: snap1})
         lzc.lzc_destroy_snaps([snap1], defer=False)
 
-        with tempfile.TemporaryFile(suffix='.ztream') as output:
+        with ztream() as output:
             fd = output.fileno()
             lzc.lzc_send(snap2, bmark, fd)
 
@@ -1703,7 +1921,7 @@ class ZFSTest(unittest.TestCase):
 
         with self.assertRaises(lzc_exc.StreamIOError) as ctx:
             lzc.lzc_send(snap, None, bad_fd)
-        self.assertEquals(ctx.exception.errno, errno.EBADF)
+        self.assertEqual(ctx.exception.errno, errno.EBADF)
 
     def test_send_bad_fd_2(self):
         snap = ZFSTest.pool.makeName("fs1@snap")
@@ -1711,7 +1929,7 @@ class ZFSTest(unittest.TestCase):
 
         with self.assertRaises(lzc_exc.StreamIOError) as ctx:
             lzc.lzc_send(snap, None, -2)
-        self.assertEquals(ctx.exception.errno, errno.EBADF)
+        self.assertEqual(ctx.exception.errno, errno.EBADF)
 
     def test_send_bad_fd_3(self):
         snap = ZFSTest.pool.makeName("fs1@snap")
@@ -1720,34 +1938,46 @@ class ZFSTest(unittest.TestCase):
         with tempfile.TemporaryFile() as tmp:
             bad_fd = tmp.fileno()
 
-        (soft, hard) = resource.getrlimit(resource.RLIMIT_NOFILE)
-        bad_fd = hard + 1
+        bad_fd = _HARD_NOFILE + 1
         with self.assertRaises(lzc_exc.StreamIOError) as ctx:
             lzc.lzc_send(snap, None, bad_fd)
-        self.assertEquals(ctx.exception.errno, errno.EBADF)
+        self.assertEqual(ctx.exception.errno, errno.EBADF)
 
     def test_send_to_broken_pipe(self):
         snap = ZFSTest.pool.makeName("fs1@snap")
         lzc.lzc_snapshot([snap])
 
-        proc = subprocess.Popen(['true'], stdin=subprocess.PIPE)
-        proc.wait()
-        with self.assertRaises(lzc_exc.StreamIOError) as ctx:
-            lzc.lzc_send(snap, None, proc.stdin.fileno())
-        self.assertEquals(ctx.exception.errno, errno.EPIPE)
+        (rfd, wfd) = os.pipe()
+        os.close(rfd)
+        try:
+            with self.assertRaises(lzc_exc.StreamIOError) as ctx:
+                lzc.lzc_send(snap, None, wfd)
+        finally:
+            os.close(wfd)
+        self.assertEqual(ctx.exception.errno, errno.EPIPE)
 
     def test_send_to_broken_pipe_2(self):
         snap = ZFSTest.pool.makeName("fs1@snap")
-        with zfs_mount(ZFSTest.pool.makeName("fs1")) as mntdir:
-            with tempfile.NamedTemporaryFile(dir=mntdir) as f:
-                for i in range(1024):
-                    f.write('x' * 1024)
-                f.flush()
-                lzc.lzc_snapshot([snap])
+        snapshot_with_data(snap)
 
-        proc = subprocess.Popen(['sleep', '2'], stdin=subprocess.PIPE)
-        with self.assertRaises(lzc_exc.StreamIOError) as ctx:
-            lzc.lzc_send(snap, None, proc.stdin.fileno())
+        (rfd, wfd) = os.pipe()
+
+        # The stream is much larger than the pipe's capacity, so the pipe
+        # gets closed while lzc_send is still writing to it.
+        def _read_and_close():
+            os.read(rfd, 64 * 1024)
+            os.close(rfd)
+
+        reader = threading.Thread(target=_read_and_close)
+        reader.start()
+        try:
+            with self.assertRaises(lzc_exc.StreamIOError) as ctx:
+                lzc.lzc_send(snap, None, wfd)
+        finally:
+            # Closing the write end first wakes up the reader even if
+            # lzc_send did not write anything.
+            os.close(wfd)
+            reader.join()
         self.assertTrue(ctx.exception.errno == errno.EPIPE or
                         ctx.exception.errno == errno.EINTR)
 
@@ -1755,15 +1985,20 @@ class ZFSTest(unittest.TestCase):
         snap = ZFSTest.pool.makeName("fs1@snap")
         lzc.lzc_snapshot([snap])
 
-        with tempfile.NamedTemporaryFile(suffix='.ztream', delete=False) as output:
-            # tempfile always opens a temporary file in read-write mode
-            # regardless of the specified mode, so we have to open it again.
-            os.chmod(output.name, stat.S_IRUSR)
-            fd = os.open(output.name, os.O_RDONLY)
-            with self.assertRaises(lzc_exc.StreamIOError) as ctx:
-                lzc.lzc_send(snap, None, fd)
-            os.close(fd)
-        self.assertEquals(ctx.exception.errno, errno.EBADF)
+        # tempfile always opens a temporary file in read-write mode,
+        # so the file has to be opened again read-only.
+        (fd, path) = tempfile.mkstemp(suffix='.ztream')
+        os.close(fd)
+        try:
+            fd = os.open(path, os.O_RDONLY)
+            try:
+                with self.assertRaises(lzc_exc.StreamIOError) as ctx:
+                    lzc.lzc_send(snap, None, fd)
+            finally:
+                os.close(fd)
+        finally:
+            os.unlink(path)
+        self.assertEqual(ctx.exception.errno, errno.EBADF)
 
     def test_recv_full(self):
         src = ZFSTest.pool.makeName("fs1@snap")
@@ -1772,15 +2007,13 @@ class ZFSTest(unittest.TestCase):
         with temp_file_in_fs(ZFSTest.pool.makeName("fs1")) as name:
             lzc.lzc_snapshot([src])
 
-        with tempfile.TemporaryFile(suffix='.ztream') as stream:
-            lzc.lzc_send(src, None, stream.fileno())
-            stream.seek(0)
-            lzc.lzc_receive(dst, stream.fileno())
+        with piped_stream(src) as fd:
+            lzc.lzc_receive(dst, fd)
 
         name = os.path.basename(name)
-        with zfs_mount(src) as mnt1, zfs_mount(dst) as mnt2:
-            self.assertTrue(
-                filecmp.cmp(os.path.join(mnt1, name), os.path.join(mnt2, name), False))
+        with zfs_mount(dst) as mntdir:
+            self.assertTrue(_file_contents_equal(
+                os.path.join(mntdir, name), _TEMP_FILE_DATA))
 
     def test_recv_incremental(self):
         src1 = ZFSTest.pool.makeName("fs1@snap1")
@@ -1792,19 +2025,15 @@ class ZFSTest(unittest.TestCase):
         with temp_file_in_fs(ZFSTest.pool.makeName("fs1")) as name:
             lzc.lzc_snapshot([src2])
 
-        with tempfile.TemporaryFile(suffix='.ztream') as stream:
-            lzc.lzc_send(src1, None, stream.fileno())
-            stream.seek(0)
-            lzc.lzc_receive(dst1, stream.fileno())
-        with tempfile.TemporaryFile(suffix='.ztream') as stream:
-            lzc.lzc_send(src2, src1, stream.fileno())
-            stream.seek(0)
-            lzc.lzc_receive(dst2, stream.fileno())
+        with piped_stream(src1) as fd:
+            lzc.lzc_receive(dst1, fd)
+        with piped_stream(src2, src1) as fd:
+            lzc.lzc_receive(dst2, fd)
 
         name = os.path.basename(name)
-        with zfs_mount(src2) as mnt1, zfs_mount(dst2) as mnt2:
-            self.assertTrue(
-                filecmp.cmp(os.path.join(mnt1, name), os.path.join(mnt2, name), False))
+        with zfs_mount(dst2) as mntdir:
+            self.assertTrue(_file_contents_equal(
+                os.path.join(mntdir, name), _TEMP_FILE_DATA))
 
     # This test case fails unless unless a patch from
     # https://clusterhq.atlassian.net/browse/ZFS-20
@@ -1832,17 +2061,13 @@ class ZFSTest(unittest.TestCase):
         clone_dst = ZFSTest.pool.makeName("fs1/fs/recv-clone@snap")
 
         lzc.lzc_snapshot([orig_src])
-        with tempfile.TemporaryFile(suffix='.ztream') as stream:
-            lzc.lzc_send(orig_src, None, stream.fileno())
-            stream.seek(0)
-            lzc.lzc_receive(orig_dst, stream.fileno())
+        with piped_stream(orig_src) as fd:
+            lzc.lzc_receive(orig_dst, fd)
 
         lzc.lzc_clone(clone, orig_src)
         lzc.lzc_snapshot([clone_snap])
-        with tempfile.TemporaryFile(suffix='.ztream') as stream:
-            lzc.lzc_send(clone_snap, orig_src, stream.fileno())
-            stream.seek(0)
-            lzc.lzc_receive(clone_dst, stream.fileno(), origin=orig_dst)
+        with piped_stream(clone_snap, orig_src) as fd:
+            lzc.lzc_receive(clone_dst, fd, origin=orig_dst)
 
     def test_recv_full_already_existing_empty_fs(self):
         src = ZFSTest.pool.makeName("fs1@snap")
@@ -1852,7 +2077,7 @@ class ZFSTest(unittest.TestCase):
         with temp_file_in_fs(ZFSTest.pool.makeName("fs1")):
             lzc.lzc_snapshot([src])
         lzc.lzc_create(dstfs)
-        with tempfile.TemporaryFile(suffix='.ztream') as stream:
+        with ztream() as stream:
             lzc.lzc_send(src, None, stream.fileno())
             stream.seek(0)
             with self.assertRaises((lzc_exc.DestinationModified, lzc_exc.DatasetExists)):
@@ -1889,7 +2114,7 @@ class ZFSTest(unittest.TestCase):
             lzc.lzc_snapshot([src])
         lzc.lzc_create(dstfs)
         with temp_file_in_fs(dstfs):
-            with tempfile.TemporaryFile(suffix='.ztream') as stream:
+            with ztream() as stream:
                 lzc.lzc_send(src, None, stream.fileno())
                 stream.seek(0)
                 with self.assertRaises((lzc_exc.DestinationModified, lzc_exc.DatasetExists)):
@@ -1904,7 +2129,7 @@ class ZFSTest(unittest.TestCase):
             lzc.lzc_snapshot([src])
         lzc.lzc_create(dstfs)
         lzc.lzc_snapshot([dstfs + "@snap1"])
-        with tempfile.TemporaryFile(suffix='.ztream') as stream:
+        with ztream() as stream:
             lzc.lzc_send(src, None, stream.fileno())
             stream.seek(0)
             with self.assertRaises((lzc_exc.StreamMismatch, lzc_exc.DatasetExists)):
@@ -1919,7 +2144,7 @@ class ZFSTest(unittest.TestCase):
             lzc.lzc_snapshot([src])
         lzc.lzc_create(dstfs)
         lzc.lzc_snapshot([dst])
-        with tempfile.TemporaryFile(suffix='.ztream') as stream:
+        with ztream() as stream:
             lzc.lzc_send(src, None, stream.fileno())
             stream.seek(0)
             with self.assertRaises(lzc_exc.DatasetExists):
@@ -1931,7 +2156,7 @@ class ZFSTest(unittest.TestCase):
 
         with temp_file_in_fs(ZFSTest.pool.makeName("fs1")):
             lzc.lzc_snapshot([src])
-        with tempfile.TemporaryFile(suffix='.ztream') as stream:
+        with ztream() as stream:
             lzc.lzc_send(src, None, stream.fileno())
             stream.seek(0)
             with self.assertRaises(lzc_exc.DatasetNotFound):
@@ -2128,14 +2353,14 @@ class ZFSTest(unittest.TestCase):
         clone_dst = ZFSTest.pool.makeName("fs1/fs/recv-clone-2@snap")
 
         lzc.lzc_snapshot([orig_src])
-        with tempfile.TemporaryFile(suffix='.ztream') as stream:
+        with ztream() as stream:
             lzc.lzc_send(orig_src, None, stream.fileno())
             stream.seek(0)
             lzc.lzc_receive(orig_dst, stream.fileno())
 
         lzc.lzc_clone(clone, orig_src)
         lzc.lzc_snapshot([clone_snap])
-        with tempfile.TemporaryFile(suffix='.ztream') as stream:
+        with ztream() as stream:
             lzc.lzc_send(clone_snap, orig_src, stream.fileno())
             stream.seek(0)
             with self.assertRaises(lzc_exc.BadStream):
@@ -2149,14 +2374,14 @@ class ZFSTest(unittest.TestCase):
         clone_dst = ZFSTest.pool.makeName("fs1/fs/recv-clone-3@snap")
 
         lzc.lzc_snapshot([orig_src])
-        with tempfile.TemporaryFile(suffix='.ztream') as stream:
+        with ztream() as stream:
             lzc.lzc_send(orig_src, None, stream.fileno())
             stream.seek(0)
             lzc.lzc_receive(orig_dst, stream.fileno())
 
         lzc.lzc_clone(clone, orig_src)
         lzc.lzc_snapshot([clone_snap])
-        with tempfile.TemporaryFile(suffix='.ztream') as stream:
+        with ztream() as stream:
             lzc.lzc_send(clone_snap, orig_src, stream.fileno())
             stream.seek(0)
             with self.assertRaises(lzc_exc.NameInvalid):
@@ -2172,15 +2397,14 @@ class ZFSTest(unittest.TestCase):
         wrong_origin = ZFSTest.pool.makeName("fs1/fs@snap")
 
         lzc.lzc_snapshot([orig_src])
-        with tempfile.TemporaryFile(suffix='.ztream') as stream:
+        with ztream() as stream:
             lzc.lzc_send(orig_src, None, stream.fileno())
             stream.seek(0)
             lzc.lzc_receive(orig_dst, stream.fileno())
 
         lzc.lzc_clone(clone, orig_src)
-        lzc.lzc_snapshot([clone_snap])
-        lzc.lzc_snapshot([wrong_origin])
-        with tempfile.TemporaryFile(suffix='.ztream') as stream:
+        lzc.lzc_snapshot([clone_snap, wrong_origin])
+        with ztream() as stream:
             lzc.lzc_send(clone_snap, orig_src, stream.fileno())
             stream.seek(0)
             with self.assertRaises(lzc_exc.StreamMismatch):
@@ -2196,14 +2420,14 @@ class ZFSTest(unittest.TestCase):
         wrong_origin = ZFSTest.pool.makeName("fs1/fs@snap")
 
         lzc.lzc_snapshot([orig_src])
-        with tempfile.TemporaryFile(suffix='.ztream') as stream:
+        with ztream() as stream:
             lzc.lzc_send(orig_src, None, stream.fileno())
             stream.seek(0)
             lzc.lzc_receive(orig_dst, stream.fileno())
 
         lzc.lzc_clone(clone, orig_src)
         lzc.lzc_snapshot([clone_snap])
-        with tempfile.TemporaryFile(suffix='.ztream') as stream:
+        with ztream() as stream:
             lzc.lzc_send(clone_snap, orig_src, stream.fileno())
             stream.seek(0)
             with self.assertRaises(lzc_exc.DatasetNotFound):
@@ -2222,10 +2446,8 @@ class ZFSTest(unittest.TestCase):
         with temp_file_in_fs(dstfs):
             pass  # enough to taint the fs
 
-        with tempfile.TemporaryFile(suffix='.ztream') as stream:
-            lzc.lzc_send(src, None, stream.fileno())
-            stream.seek(0)
-            lzc.lzc_receive(dst, stream.fileno(), force=True)
+        with piped_stream(src) as fd:
+            lzc.lzc_receive(dst, fd, force=True)
 
     def test_force_recv_full_existing_modified_mounted_fs(self):
         src = ZFSTest.pool.makeName("fs1@snap")
@@ -2237,7 +2459,7 @@ class ZFSTest(unittest.TestCase):
 
         lzc.lzc_create(dstfs)
 
-        with tempfile.TemporaryFile(suffix='.ztream') as stream:
+        with ztream() as stream:
             lzc.lzc_send(src, None, stream.fileno())
             stream.seek(0)
             with zfs_mount(dstfs) as mntdir:
@@ -2267,10 +2489,8 @@ class ZFSTest(unittest.TestCase):
             pass  # enough to taint the fs
         lzc.lzc_snapshot([dstfs + "@snap1"])
 
-        with tempfile.TemporaryFile(suffix='.ztream') as stream:
-            lzc.lzc_send(src, None, stream.fileno())
-            stream.seek(0)
-            lzc.lzc_receive(dst, stream.fileno(), force=True)
+        with piped_stream(src) as fd:
+            lzc.lzc_receive(dst, fd, force=True)
 
     def test_force_recv_full_already_existing_with_same_snap(self):
         src = ZFSTest.pool.makeName("fs1@snap")
@@ -2285,7 +2505,7 @@ class ZFSTest(unittest.TestCase):
             pass  # enough to taint the fs
         lzc.lzc_snapshot([dst])
 
-        with tempfile.TemporaryFile(suffix='.ztream') as stream:
+        with ztream() as stream:
             lzc.lzc_send(src, None, stream.fileno())
             stream.seek(0)
             with self.assertRaises(lzc_exc.DatasetExists):
@@ -2297,7 +2517,7 @@ class ZFSTest(unittest.TestCase):
 
         with temp_file_in_fs(ZFSTest.pool.makeName("fs1")):
             lzc.lzc_snapshot([src])
-        with tempfile.TemporaryFile(suffix='.ztream') as stream:
+        with ztream() as stream:
             lzc.lzc_send(src, None, stream.fileno())
             stream.seek(0)
             with self.assertRaises(lzc_exc.DatasetNotFound):
@@ -2449,7 +2669,7 @@ class ZFSTest(unittest.TestCase):
 
         (_, (_, tosnap, _)) = make_snapshots(clonefs, None, "snap", None)
 
-        with tempfile.TemporaryFile(suffix='.ztream') as stream:
+        with ztream() as stream:
             lzc.lzc_send(tosnap, None, stream.fileno())
 
     def test_send_incr_across_clone_branch_point(self):
@@ -2463,7 +2683,7 @@ class ZFSTest(unittest.TestCase):
 
         (_, (_, tosnap, _)) = make_snapshots(clonefs, None, "snap", None)
 
-        with tempfile.TemporaryFile(suffix='.ztream') as stream:
+        with ztream() as stream:
             lzc.lzc_send(tosnap, fromsnap, stream.fileno())
 
     def test_recv_full_across_clone_branch_point(self):
@@ -2479,10 +2699,8 @@ class ZFSTest(unittest.TestCase):
 
         recvfs = ZFSTest.pool.makeName("fs1/recv-clone-30")
         recvsnap = recvfs + "@snap"
-        with tempfile.TemporaryFile(suffix='.ztream') as stream:
-            lzc.lzc_send(tosnap, None, stream.fileno())
-            stream.seek(0)
-            lzc.lzc_receive(recvsnap, stream.fileno())
+        with piped_stream(tosnap) as fd:
+            lzc.lzc_receive(recvsnap, fd)
 
     def test_recv_incr_across_clone_branch_point__no_origin(self):
         origfs = ZFSTest.pool.makeName("fs2")
@@ -2498,11 +2716,9 @@ class ZFSTest(unittest.TestCase):
         recvfs = ZFSTest.pool.makeName("fs1/recv-clone-32")
         recvsnap1 = recvfs + "@snap1"
         recvsnap2 = recvfs + "@snap2"
-        with tempfile.TemporaryFile(suffix='.ztream') as stream:
-            lzc.lzc_send(fromsnap, None, stream.fileno())
-            stream.seek(0)
-            lzc.lzc_receive(recvsnap1, stream.fileno())
-        with tempfile.TemporaryFile(suffix='.ztream') as stream:
+        with piped_stream(fromsnap) as fd:
+            lzc.lzc_receive(recvsnap1, fd)
+        with ztream() as stream:
             lzc.lzc_send(tosnap, fromsnap, stream.fileno())
             stream.seek(0)
             with self.assertRaises(lzc_exc.BadStream):
@@ -2522,11 +2738,9 @@ class ZFSTest(unittest.TestCase):
         recvfs = ZFSTest.pool.makeName("fs1/recv-clone-31")
         recvsnap1 = recvfs + "@snap1"
         recvsnap2 = recvfs + "@snap2"
-        with tempfile.TemporaryFile(suffix='.ztream') as stream:
-            lzc.lzc_send(fromsnap, None, stream.fileno())
-            stream.seek(0)
-            lzc.lzc_receive(recvsnap1, stream.fileno())
-        with tempfile.TemporaryFile(suffix='.ztream') as stream:
+        with piped_stream(fromsnap) as fd:
+            lzc.lzc_receive(recvsnap1, fd)
+        with ztream() as stream:
             lzc.lzc_send(tosnap, fromsnap, stream.fileno())
             stream.seek(0)
             with self.assertRaises(lzc_exc.BadStream):
@@ -2547,14 +2761,10 @@ class ZFSTest(unittest.TestCase):
         recvsnap1 = recvfs1 + "@snap"
         recvfs2 = ZFSTest.pool.makeName("fs1/recv-clone-33_2")
         recvsnap2 = recvfs2 + "@snap"
-        with tempfile.TemporaryFile(suffix='.ztream') as stream:
-            lzc.lzc_send(fromsnap, None, stream.fileno())
-            stream.seek(0)
-            lzc.lzc_receive(recvsnap1, stream.fileno())
-        with tempfile.TemporaryFile(suffix='.ztream') as stream:
-            lzc.lzc_send(tosnap, fromsnap, stream.fileno())
-            stream.seek(0)
-            lzc.lzc_receive(recvsnap2, stream.fileno(), origin=recvsnap1)
+        with piped_stream(fromsnap) as fd:
+            lzc.lzc_receive(recvsnap1, fd)
+        with piped_stream(tosnap, fromsnap) as fd:
+            lzc.lzc_receive(recvsnap2, fd, origin=recvsnap1)
 
     def test_recv_bad_stream(self):
         dstfs = ZFSTest.pool.makeName("fs2/received")
@@ -2604,7 +2814,7 @@ class ZFSTest(unittest.TestCase):
 
     @unittest.skipIf(*illumos_bug_6379())
     def test_hold_bad_fd(self):
-        snap = ZFSTest.pool.getRoot().getSnap()
+        snap = self._snap()
         lzc.lzc_snapshot([snap])
 
         with tempfile.TemporaryFile() as tmp:
@@ -2615,7 +2825,7 @@ class ZFSTest(unittest.TestCase):
 
     @unittest.skipIf(*illumos_bug_6379())
     def test_hold_bad_fd_2(self):
-        snap = ZFSTest.pool.getRoot().getSnap()
+        snap = self._snap()
         lzc.lzc_snapshot([snap])
 
         with self.assertRaises(lzc_exc.BadHoldCleanupFD):
@@ -2623,17 +2833,16 @@ class ZFSTest(unittest.TestCase):
 
     @unittest.skipIf(*illumos_bug_6379())
     def test_hold_bad_fd_3(self):
-        snap = ZFSTest.pool.getRoot().getSnap()
+        snap = self._snap()
         lzc.lzc_snapshot([snap])
 
-        (soft, hard) = resource.getrlimit(resource.RLIMIT_NOFILE)
-        bad_fd = hard + 1
+        bad_fd = _HARD_NOFILE + 1
         with self.assertRaises(lzc_exc.BadHoldCleanupFD):
             lzc.lzc_hold({snap: 'tag'}, bad_fd)
 
     @unittest.skipIf(*illumos_bug_6379())
     def test_hold_wrong_fd(self):
-        snap = ZFSTest.pool.getRoot().getSnap()
+        snap = self._snap()
         lzc.lzc_snapshot([snap])
 
         with tempfile.TemporaryFile() as tmp:
@@ -2642,7 +2851,7 @@ class ZFSTest(unittest.TestCase):
                 lzc.lzc_hold({snap: 'tag'}, fd)
 
     def test_hold_fd(self):
-        snap = ZFSTest.pool.getRoot().getSnap()
+        snap = self._snap()
         lzc.lzc_snapshot([snap])
 
         with cleanup_fd() as fd:
@@ -2652,11 +2861,8 @@ class ZFSTest(unittest.TestCase):
         with cleanup_fd() as fd:
             lzc.lzc_hold({}, fd)
 
-    def test_hold_empty_2(self):
-        lzc.lzc_hold({})
-
     def test_hold_vs_snap_destroy(self):
-        snap = ZFSTest.pool.getRoot().getSnap()
+        snap = self._snap()
         lzc.lzc_snapshot([snap])
 
         with cleanup_fd() as fd:
@@ -2674,7 +2880,7 @@ class ZFSTest(unittest.TestCase):
         self.assertNotExists(snap)
 
     def test_hold_many_tags(self):
-        snap = ZFSTest.pool.getRoot().getSnap()
+        snap = self._snap()
         lzc.lzc_snapshot([snap])
 
         with cleanup_fd() as fd:
@@ -2682,8 +2888,8 @@ class ZFSTest(unittest.TestCase):
             lzc.lzc_hold({snap: 'tag2'}, fd)
 
     def test_hold_many_snaps(self):
-        snap1 = ZFSTest.pool.getRoot().getSnap()
-        snap2 = ZFSTest.pool.getRoot().getSnap()
+        snap1 = self._snap()
+        snap2 = self._snap()
         lzc.lzc_snapshot([snap1])
         lzc.lzc_snapshot([snap2])
 
@@ -2691,8 +2897,8 @@ class ZFSTest(unittest.TestCase):
             lzc.lzc_hold({snap1: 'tag', snap2: 'tag'}, fd)
 
     def test_hold_many_with_one_missing(self):
-        snap1 = ZFSTest.pool.getRoot().getSnap()
-        snap2 = ZFSTest.pool.getRoot().getSnap()
+        snap1 = self._snap()
+        snap2 = self._snap()
         lzc.lzc_snapshot([snap1])
 
         with cleanup_fd() as fd:
@@ -2701,8 +2907,8 @@ class ZFSTest(unittest.TestCase):
         self.assertEqual(missing[0], snap2)
 
     def test_hold_many_with_all_missing(self):
-        snap1 = ZFSTest.pool.getRoot().getSnap()
-        snap2 = ZFSTest.pool.getRoot().getSnap()
+        snap1 = self._snap()
+        snap2 = self._snap()
 
         with cleanup_fd() as fd:
             missing = lzc.lzc_hold({snap1: 'tag', snap2: 'tag'}, fd)
@@ -2711,12 +2917,8 @@ class ZFSTest(unittest.TestCase):
 
     def test_hold_missing_fs(self):
         # XXX skip pre-created filesystems
-        ZFSTest.pool.getRoot().getFilesystem()
-        ZFSTest.pool.getRoot().getFilesystem()
-        ZFSTest.pool.getRoot().getFilesystem()
-        ZFSTest.pool.getRoot().getFilesystem()
-        ZFSTest.pool.getRoot().getFilesystem()
-        snap = ZFSTest.pool.getRoot().getFilesystem().getSnap()
+        ZFSTest.pool.getRoot().skipFilesystemIds(5)
+        snap = self._fs().getSnap()
 
         with self.assertRaises(lzc_exc.HoldFailure) as ctx:
             lzc.lzc_hold({snap: 'tag'})
@@ -2725,12 +2927,8 @@ class ZFSTest(unittest.TestCase):
 
     def test_hold_missing_fs_auto_cleanup(self):
         # XXX skip pre-created filesystems
-        ZFSTest.pool.getRoot().getFilesystem()
-        ZFSTest.pool.getRoot().getFilesystem()
-        ZFSTest.pool.getRoot().getFilesystem()
-        ZFSTest.pool.getRoot().getFilesystem()
-        ZFSTest.pool.getRoot().getFilesystem()
-        snap = ZFSTest.pool.getRoot().getFilesystem().getSnap()
+        ZFSTest.pool.getRoot().skipFilesystemIds(5)
+        snap = self._fs().getSnap()
 
         with cleanup_fd() as fd:
             with self.assertRaises(lzc_exc.HoldFailure) as ctx:
@@ -2739,7 +2937,7 @@ class ZFSTest(unittest.TestCase):
             self.assertIsInstance(e, lzc_exc.FilesystemNotFound)
 
     def test_hold_duplicate(self):
-        snap = ZFSTest.pool.getRoot().getSnap()
+        snap = self._snap()
         lzc.lzc_snapshot([snap])
 
         with cleanup_fd() as fd:
@@ -2750,7 +2948,7 @@ class ZFSTest(unittest.TestCase):
             self.assertIsInstance(e, lzc_exc.HoldExists)
 
     def test_hold_across_pools(self):
-        snap1 = ZFSTest.pool.getRoot().getSnap()
+        snap1 = self._snap()
         snap2 = ZFSTest.misc_pool.getRoot().getSnap()
         lzc.lzc_snapshot([snap1])
         lzc.lzc_snapshot([snap2])
@@ -2762,8 +2960,8 @@ class ZFSTest(unittest.TestCase):
             self.assertIsInstance(e, lzc_exc.PoolsDiffer)
 
     def test_hold_too_long_tag(self):
-        snap = ZFSTest.pool.getRoot().getSnap()
-        tag = 't' * 256
+        snap = self._snap()
+        tag = _TOO_LONG_TAG
         lzc.lzc_snapshot([snap])
 
         with cleanup_fd() as fd:
@@ -2771,7 +2969,7 @@ class ZFSTest(unittest.TestCase):
                 lzc.lzc_hold({snap: tag}, fd)
         for e in ctx.exception.errors:
             self.assertIsInstance(e, lzc_exc.NameTooLong)
-            self.assertEquals(e.name, tag)
+            self.assertEqual(e.name, tag)
 
     # Apparently the full snapshot name is not checked for length
     # and this snapshot is treated as simply missing.
@@ -2783,7 +2981,7 @@ class ZFSTest(unittest.TestCase):
                 lzc.lzc_hold({snap: 'tag'}, fd)
         for e in ctx.exception.errors:
             self.assertIsInstance(e, lzc_exc.NameTooLong)
-            self.assertEquals(e.name, snap)
+            self.assertEqual(e.name, snap)
 
     def test_hold_too_long_snap_name_2(self):
         snap = ZFSTest.pool.getRoot().getTooLongSnap(True)
@@ -2792,28 +2990,28 @@ class ZFSTest(unittest.TestCase):
                 lzc.lzc_hold({snap: 'tag'}, fd)
         for e in ctx.exception.errors:
             self.assertIsInstance(e, lzc_exc.NameTooLong)
-            self.assertEquals(e.name, snap)
+            self.assertEqual(e.name, snap)
 
     def test_hold_invalid_snap_name(self):
-        snap = ZFSTest.pool.getRoot().getSnap() + '@bad'
+        snap = self._snap() + '@bad'
         with cleanup_fd() as fd:
             with self.assertRaises(lzc_exc.HoldFailure) as ctx:
                 lzc.lzc_hold({snap: 'tag'}, fd)
         for e in ctx.exception.errors:
             self.assertIsInstance(e, lzc_exc.NameInvalid)
-            self.assertEquals(e.name, snap)
+            self.assertEqual(e.name, snap)
 
     def test_hold_invalid_snap_name_2(self):
-        snap = ZFSTest.pool.getRoot().getFilesystem().getName()
+        snap = self._fs().getName()
         with cleanup_fd() as fd:
             with self.assertRaises(lzc_exc.HoldFailure) as ctx:
                 lzc.lzc_hold({snap: 'tag'}, fd)
         for e in ctx.exception.errors:
             self.assertIsInstance(e, lzc_exc.NameInvalid)
-            self.assertEquals(e.name, snap)
+            self.assertEqual(e.name, snap)
 
     def test_get_holds(self):
-        snap = ZFSTest.pool.getRoot().getSnap()
+        snap = self._snap()
         lzc.lzc_snapshot([snap])
 
         with cleanup_fd() as fd:
@@ -2821,13 +3019,13 @@ class ZFSTest(unittest.TestCase):
             lzc.lzc_hold({snap: 'tag2'}, fd)
 
             holds = lzc.lzc_get_holds(snap)
-            self.assertEquals(len(holds), 2)
+            self.assertEqual(len(holds), 2)
             self.assertIn('tag1', holds)
             self.assertIn('tag2', holds)
             self.assertIsInstance(holds['tag1'], (int, long))
 
     def test_get_holds_after_auto_cleanup(self):
-        snap = ZFSTest.pool.getRoot().getSnap()
+        snap = self._snap()
         lzc.lzc_snapshot([snap])
 
         with cleanup_fd() as fd:
@@ -2835,11 +3033,11 @@ class ZFSTest(unittest.TestCase):
             lzc.lzc_hold({snap: 'tag2'}, fd)
 
         holds = lzc.lzc_get_holds(snap)
-        self.assertEquals(len(holds), 0)
+        self.assertEqual(len(holds), 0)
         self.assertIsInstance(holds, dict)
 
     def test_get_holds_nonexistent_snap(self):
-        snap = ZFSTest.pool.getRoot().getSnap()
+        snap = self._snap()
         with self.assertRaises(lzc_exc.SnapshotNotFound):
             lzc.lzc_get_holds(snap)
 
@@ -2854,7 +3052,7 @@ class ZFSTest(unittest.TestCase):
             lzc.lzc_get_holds(snap)
 
     def test_get_holds_invalid_snap_name(self):
-        snap = ZFSTest.pool.getRoot().getSnap() + '@bad'
+        snap = self._snap() + '@bad'
         with self.assertRaises(lzc_exc.NameInvalid):
             lzc.lzc_get_holds(snap)
 
@@ -2862,26 +3060,22 @@ class ZFSTest(unittest.TestCase):
     # an invalid name.
     @unittest.expectedFailure
     def test_get_holds_invalid_snap_name_2(self):
-        snap = ZFSTest.pool.getRoot().getFilesystem().getName()
+        snap = self._fs().getName()
         with self.assertRaises(lzc_exc.NameInvalid):
             lzc.lzc_get_holds(snap)
 
     def test_release_hold(self):
-        snap = ZFSTest.pool.getRoot().getSnap()
+        snap = self._snap()
         lzc.lzc_snapshot([snap])
 
         lzc.lzc_hold({snap: 'tag'})
         ret = lzc.lzc_release({snap: ['tag']})
-        self.assertEquals(len(ret), 0)
-
-    def test_release_hold_empty(self):
-        ret = lzc.lzc_release({})
-        self.assertEquals(len(ret), 0)
+        self.assertEqual(len(ret), 0)
 
     def test_release_hold_complex(self):
-        snap1 = ZFSTest.pool.getRoot().getSnap()
-        snap2 = ZFSTest.pool.getRoot().getSnap()
-        snap3 = ZFSTest.pool.getRoot().getFilesystem().getSnap()
+        snap1 = self._snap()
+        snap2 = self._snap()
+        snap3 = self._fs().getSnap()
         lzc.lzc_snapshot([snap1])
         lzc.lzc_snapshot([snap2, snap3])
 
@@ -2891,12 +3085,13 @@ class ZFSTest(unittest.TestCase):
         lzc.lzc_hold({snap3: 'tag1'})
         lzc.lzc_hold({snap3: 'tag2'})
 
-        holds = lzc.lzc_get_holds(snap1)
-        self.assertEquals(len(holds), 2)
-        holds = lzc.lzc_get_holds(snap2)
-        self.assertEquals(len(holds), 1)
-        holds = lzc.lzc_get_holds(snap3)
-        self.assertEquals(len(holds), 2)
+        expected = {
+            snap1: {'tag1', 'tag2'},
+            snap2: {'tag'},
+            snap3: {'tag1', 'tag2'},
+        }
+        for snap, tags in expected.items():
+            self.assertEqual(set(lzc.lzc_get_holds(snap)), tags)
 
         release = {
             snap1: ['tag1', 'tag2'],
@@ -2904,31 +3099,28 @@ class ZFSTest(unittest.TestCase):
             snap3: ['tag2'],
         }
         ret = lzc.lzc_release(release)
-        self.assertEquals(len(ret), 0)
+        self.assertEqual(len(ret), 0)
 
-        holds = lzc.lzc_get_holds(snap1)
-        self.assertEquals(len(holds), 0)
-        holds = lzc.lzc_get_holds(snap2)
-        self.assertEquals(len(holds), 0)
-        holds = lzc.lzc_get_holds(snap3)
-        self.assertEquals(len(holds), 1)
+        for snap, tags in expected.items():
+            self.assertEqual(
+                set(lzc.lzc_get_holds(snap)), tags - set(release[snap]))
 
         ret = lzc.lzc_release({snap3: ['tag1']})
-        self.assertEquals(len(ret), 0)
+        self.assertEqual(len(ret), 0)
         holds = lzc.lzc_get_holds(snap3)
-        self.assertEquals(len(holds), 0)
+        self.assertEqual(len(holds), 0)
 
     def test_release_hold_before_auto_cleanup(self):
-        snap = ZFSTest.pool.getRoot().getSnap()
+        snap = self._snap()
         lzc.lzc_snapshot([snap])
 
         with cleanup_fd() as fd:
             lzc.lzc_hold({snap: 'tag'}, fd)
             ret = lzc.lzc_release({snap: ['tag']})
-            self.assertEquals(len(ret), 0)
+            self.assertEqual(len(ret), 0)
 
     def test_release_hold_and_snap_destruction(self):
-        snap = ZFSTest.pool.getRoot().getSnap()
+        snap = self._snap()
         lzc.lzc_snapshot([snap])
 
         with cleanup_fd() as fd:
@@ -2945,7 +3137,7 @@ class ZFSTest(unittest.TestCase):
             self.assertNotExists(snap)
 
     def test_release_hold_and_multiple_snap_destruction(self):
-        snap = ZFSTest.pool.getRoot().getSnap()
+        snap = self._snap()
         lzc.lzc_snapshot([snap])
 
         with cleanup_fd() as fd:
@@ -2961,29 +3153,29 @@ class ZFSTest(unittest.TestCase):
             self.assertNotExists(snap)
 
     def test_release_hold_missing_tag(self):
-        snap = ZFSTest.pool.getRoot().getSnap()
+        snap = self._snap()
         lzc.lzc_snapshot([snap])
 
         ret = lzc.lzc_release({snap: ['tag']})
-        self.assertEquals(len(ret), 1)
-        self.assertEquals(ret[0], snap + '#tag')
+        self.assertEqual(len(ret), 1)
+        self.assertEqual(ret[0], snap + '#tag')
 
     def test_release_hold_missing_snap(self):
-        snap = ZFSTest.pool.getRoot().getSnap()
+        snap = self._snap()
 
         ret = lzc.lzc_release({snap: ['tag']})
-        self.assertEquals(len(ret), 1)
-        self.assertEquals(ret[0], snap)
+        self.assertEqual(len(ret), 1)
+        self.assertEqual(ret[0], snap)
 
     def test_release_hold_missing_snap_2(self):
-        snap = ZFSTest.pool.getRoot().getSnap()
+        snap = self._snap()
 
         ret = lzc.lzc_release({snap: ['tag', 'another']})
-        self.assertEquals(len(ret), 1)
-        self.assertEquals(ret[0], snap)
+        self.assertEqual(len(ret), 1)
+        self.assertEqual(ret[0], snap)
 
     def test_release_hold_across_pools(self):
-        snap1 = ZFSTest.pool.getRoot().getSnap()
+        snap1 = self._snap()
         snap2 = ZFSTest.misc_pool.getRoot().getSnap()
         lzc.lzc_snapshot([snap1])
         lzc.lzc_snapshot([snap2])
@@ -3000,8 +3192,8 @@ class ZFSTest(unittest.TestCase):
     # only its existence is checked.
     @unittest.expectedFailure
     def test_release_hold_too_long_tag(self):
-        snap = ZFSTest.pool.getRoot().getSnap()
-        tag = 't' * 256
+        snap = self._snap()
+        tag = _TOO_LONG_TAG
         lzc.lzc_snapshot([snap])
 
         with self.assertRaises(lzc_exc.HoldReleaseFailure):
@@ -3022,23 +3214,23 @@ class ZFSTest(unittest.TestCase):
             lzc.lzc_release({snap: ['tag']})
         for e in ctx.exception.errors:
             self.assertIsInstance(e, lzc_exc.NameTooLong)
-            self.assertEquals(e.name, snap)
+            self.assertEqual(e.name, snap)
 
     def test_release_hold_invalid_snap_name(self):
-        snap = ZFSTest.pool.getRoot().getSnap() + '@bad'
+        snap = self._snap() + '@bad'
         with self.assertRaises(lzc_exc.HoldReleaseFailure) as ctx:
             lzc.lzc_release({snap: ['tag']})
         for e in ctx.exception.errors:
             self.assertIsInstance(e, lzc_exc.NameInvalid)
-            self.assertEquals(e.name, snap)
+            self.assertEqual(e.name, snap)
 
     def test_release_hold_invalid_snap_name_2(self):
-        snap = ZFSTest.pool.getRoot().getFilesystem().getName()
+        snap = self._fs().getName()
         with self.assertRaises(lzc_exc.HoldReleaseFailure) as ctx:
             lzc.lzc_release({snap: ['tag']})
         for e in ctx.exception.errors:
             self.assertIsInstance(e, lzc_exc.NameInvalid)
-            self.assertEquals(e.name, snap)
+            self.assertEqual(e.name, snap)
 
     @needs_support(lzc.lzc_list_children)
     def test_list_children(self):
@@ -3430,20 +3622,95 @@ class ZFSTest(unittest.TestCase):
         self.assertTrue(actual_props[prop] != val)
 
 
-class _TempPool(object):
-    SNAPSHOTS = ['snap', 'snap1', 'snap2']
-    BOOKMARKS = ['bmark', 'bmark1', 'bmark2']
+# Tests that only use names of nonexistent pools or no names at all.
+# They do not need the test pools, so they do not pay for creating
+# and resetting them.
+class ZFSNoPoolTest(_ZFSTestCase):
+
+    def test_create_fs_in_nonexistent_pool(self):
+        name = "no-such-pool/fs"
+
+        with self.assertRaises(lzc_exc.ParentNotFound):
+            lzc.lzc_create(name)
+        self.assertNotExists(name)
+
+    def test_create_fs_with_invalid_pool_name(self):
+        name = "bad!pool/fs"
+
+        with self.assertRaises(lzc_exc.NameInvalid):
+            lzc.lzc_create(name)
+        self.assertNotExists(name)
+
+    def test_snapshot_empty_list(self):
+        lzc.lzc_snapshot([])
 
+    def test_snapshot_nonexistent_pool(self):
+        snapname = "no-such-pool@snap"
+        snaps = [snapname]
+
+        with self.assertRaises(lzc_exc.SnapshotFailure) as ctx:
+            lzc.lzc_snapshot(snaps)
+
+        self.assertEqual(len(ctx.exception.errors), 1)
+        for e in ctx.exception.errors:
+            self.assertIsInstance(e, lzc_exc.FilesystemNotFound)
+
+    def test_destroy_snapshot_of_nonexistent_pool(self):
+        with self.assertRaises(lzc_exc.SnapshotDestructionFailure) as ctx:
+            lzc.lzc_destroy_snaps(["no-such-pool@snap"], False)
+
+        for e in ctx.exception.errors:
+            self.assertIsInstance(e, lzc_exc.PoolNotFound)
+
+        with self.assertRaises(lzc_exc.SnapshotDestructionFailure) as ctx:
+            lzc.lzc_destroy_snaps(["no-such-pool@snap"], True)
+
+        for e in ctx.exception.errors:
+            self.assertIsInstance(e, lzc_exc.PoolNotFound)
+
+    def test_hold_empty_2(self):
+        lzc.lzc_hold({})
+
+    def test_release_hold_empty(self):
+        ret = lzc.lzc_release({})
+        self.assertEqual(len(ret), 0)
+
+
+# The names built by _TempPool depend only on the pool name, which never
+# changes, so each of them is computed once and then looked up in a cache
+# kept by the pool object.
+def _memoize_name(f):
+    cache_attr = '_' + f.__name__ + '_cache'
+
+    @functools.wraps(f)
+    def _memoized(self, arg=None):
+        cache = self.__dict__.setdefault(cache_attr, {})
+        try:
+            return cache[arg]
+        except KeyError:
+            name = cache[arg] = f(self, arg)
+            return name
+    return _memoized
+
+
+# Padding that makes any name or name component exceed the maximum length.
+_TOO_LONG_PADDING = 'x' * (lzc.MAXNAMELEN + 1)
+_TOO_LONG_TAG = 't' * 256
+
+
+class _TempPool(object):
     _cachefile_suffix = ".cachefile"
 
-    # XXX Whether to do a sloppy but much faster cleanup
-    # or a proper but slower one.
-    _recreate_pools = True
+    # Whether to always recreate a pool to reset it, or to first try
+    # the much faster destruction of everything created by the tests.
+    # The pool is still recreated if the latter fails.
+    _recreate_pools = False
 
     def __init__(self, size=128 * 1024 * 1024, readonly=False, filesystems=[]):
         self._filesystems = filesystems
         self._readonly = readonly
-        self._pool_name = 'pool.' + bytes(uuid.uuid4())
+        self._pool_name = 'pool.' + uuid.uuid4().hex[:12]
+        self._pool_prefix = self._pool_name + '/'
         self._root = _Filesystem(self._pool_name)
         (fd, self._pool_file_path) = tempfile.mkstemp(
             suffix='.zpool', prefix='tmp-')
@@ -3463,6 +3730,7 @@ class _TempPool(object):
             for fs in filesystems:
                 lzc.lzc_create(self.makeName(fs))
 
+            self._loadPoolFeatures()
             self._bmarks_supported = self.isPoolFeatureEnabled('bookmarks')
 
             if readonly:
@@ -3483,7 +3751,7 @@ class _TempPool(object):
             if 'permission denied' in e.output:
                 raise unittest.SkipTest(
                     'insufficient privileges to run libzfs_core tests')
-            print 'command failed: ', e.output
+            print('command failed: ', e.output)
             raise
         except Exception:
             self.cleanUp()
@@ -3494,23 +3762,13 @@ class _TempPool(object):
             return
 
         if not self.__class__._recreate_pools:
-            snaps = []
-            for fs in [''] + self._filesystems:
-                for snap in self.__class__.SNAPSHOTS:
-                    snaps.append(self.makeName(fs + '@' + snap))
-            self.getRoot().visitSnaps(lambda snap: snaps.append(snap))
-            lzc.lzc_destroy_snaps(snaps, defer=False)
-
-            if self._bmarks_supported:
-                bmarks = []
-                for fs in [''] + self._filesystems:
-                    for bmark in self.__class__.BOOKMARKS:
-                        bmarks.append(self.makeName(fs + '#' + bmark))
-                self.getRoot().visitBookmarks(
-                    lambda bmark: bmarks.append(bmark))
-                lzc.lzc_destroy_bookmarks(bmarks)
-            self.getRoot().reset()
-            return
+            try:
+                if self._destroyTestData():
+                    self.getRoot().reset()
+                    return
+            except Exception:
+                # the state of the pool is unknown, start from scratch
+                pass
 
         try:
             subprocess.check_output(
@@ -3518,12 +3776,76 @@ class _TempPool(object):
             subprocess.check_output(
                 self._zpool_create, stderr=subprocess.STDOUT)
         except subprocess.CalledProcessError as e:
-            print 'command failed: ', e.output
+            print('command failed: ', e.output)
             raise
         for fs in self._filesystems:
             lzc.lzc_create(self.makeName(fs))
         self.getRoot().reset()
 
+    def _listDatasets(self):
+        # parents are listed before their children
+        datasets = []
+        pending = [self.makeName()]
+        while pending:
+            ds = pending.pop()
+            datasets.append(ds)
+            pending.extend(lzc.lzc_list_children(ds))
+        return datasets
+
+    # Destroy all snapshots, bookmarks and datasets except for
+    # the filesystems that the pool was created with.
+    # Return False if that is not possible and the pool has to be recreated.
+    def _destroyTestData(self):
+        for func in (lzc.lzc_list_children, lzc.lzc_list_snaps, lzc.lzc_destroy_one):
+            if not lzc.is_supported(func):
+                return False
+
+        fixtures = set(self.makeName(fs) for fs in self._filesystems)
+        fixtures.add(self.makeName())
+        datasets = self._listDatasets()
+        if not fixtures.issubset(datasets):
+            return False
+
+        snaps = [snap for ds in datasets for snap in lzc.lzc_list_snaps(ds)]
+        holds = {}
+        for snap in snaps:
+            tags = lzc.lzc_get_holds(snap).keys()
+            if tags:
+                holds[snap] = tags
+        if holds:
+            lzc.lzc_release(holds)
+        if snaps:
+            # snapshots that still have clones are destroyed
+            # together with their last clone
+            lzc.lzc_destroy_snaps(snaps, defer=True)
+
+        if self._bmarks_supported:
+            bmarks = [fs + '#' + bmark
+                      for fs in fixtures for bmark in lzc.lzc_get_bookmarks(fs)]
+            if bmarks:
+                lzc.lzc_destroy_bookmarks(bmarks)
+
+        # Children go before their parents, but a clone may come after
+        # the dataset that holds its origin, so keep making passes
+        # for as long as they destroy something.
+        others = sorted((ds for ds in datasets if ds not in fixtures),
+                        key=lambda ds: ds.count('/'), reverse=True)
+        while others:
+            remaining = []
+            for ds in others:
+                try:
+                    lzc.lzc_destroy_one(ds)
+                except lzc_exc.ZFSError:
+                    remaining.append(ds)
+            if len(remaining) == len(others):
+                return False
+            others = remaining
+
+        datasets = self._listDatasets()
+        if set(datasets) != fixtures:
+            return False
+        return not any(True for ds in datasets for _ in lzc.lzc_list_snaps(ds))
+
     def cleanUp(self):
         try:
             subprocess.check_output(
@@ -3544,45 +3866,57 @@ class _TempPool(object):
         except Exception:
             pass
 
+    @_memoize_name
     def makeName(self, relative=None):
         if not relative:
             return self._pool_name
         if relative.startswith(('@', '#')):
             return self._pool_name + relative
-        return self._pool_name + '/' + relative
+        return self._pool_prefix + relative
 
+    @_memoize_name
     def makeTooLongName(self, prefix=None):
-        if not prefix:
-            prefix = 'x'
-        prefix = self.makeName(prefix)
-        pad_len = lzc.MAXNAMELEN + 1 - len(prefix)
+        name = self.makeName(prefix or 'x')
+        pad_len = lzc.MAXNAMELEN + 1 - len(name)
         if pad_len > 0:
-            return prefix + 'x' * pad_len
+            return name + _TOO_LONG_PADDING[:pad_len]
         else:
-            return prefix
+            return name
 
+    @_memoize_name
     def makeTooLongComponent(self, prefix=None):
-        padding = 'x' * (lzc.MAXNAMELEN + 1)
         if not prefix:
-            prefix = padding
+            return self.makeName(_TOO_LONG_PADDING)
         else:
-            prefix = prefix + padding
-        return self.makeName(prefix)
+            return self.makeName(prefix + _TOO_LONG_PADDING)
 
     def getRoot(self):
         return self._root
 
-    def isPoolFeatureAvailable(self, feature):
+    def _loadPoolFeatures(self):
+        # The set of features supported by the pool does not change,
+        # and a feature once enabled stays enabled (or becomes active),
+        # so the state is read once when the pool is created.
         output = subprocess.check_output(
-            ['zpool', 'get', '-H', 'feature@' + feature, self._pool_name])
-        output = output.strip()
-        return output != ''
+            ['zpool', 'get', '-H', 'all', self._pool_name])
+        available = set()
+        enabled = set()
+        for line in output.splitlines():
+            (_, prop, value, _) = line.split('\t', 3)
+            if not prop.startswith('feature@'):
+                continue
+            feature = prop[len('feature@'):]
+            available.add(feature)
+            if value in ['active', 'enabled']:
+                enabled.add(feature)
+        self._features_available = frozenset(available)
+        self._features_enabled = frozenset(enabled)
+
+    def isPoolFeatureAvailable(self, feature):
+        return feature in self._features_available
 
     def isPoolFeatureEnabled(self, feature):
-        output = subprocess.check_output(
-            ['zpool', 'get', '-H', 'feature@' + feature, self._pool_name])
-        output = output.split()[2]
-        return output in ['active', 'enabled']
+        return feature in self._features_enabled
 
 
 class _Filesystem(object):
@@ -3595,27 +3929,27 @@ class _Filesystem(object):
         return self._name
 
     def reset(self):
-        self._children = []
         self._fs_id = 0
         self._snap_id = 0
         self._bmark_id = 0
 
     def getFilesystem(self):
         self._fs_id += 1
-        fsname = self._name + '/fs' + bytes(self._fs_id)
-        fs = _Filesystem(fsname)
-        self._children.append(fs)
-        return fs
+        fsname = '%s/fs%d' % (self._name, self._fs_id)
+        return _Filesystem(fsname)
+
+    def skipFilesystemIds(self, n):
+        self._fs_id += n
 
     def _makeSnapName(self, i):
-        return self._name + '@snap' + bytes(i)
+        return '%s@snap%d' % (self._name, i)
 
     def getSnap(self):
         self._snap_id += 1
         return self._makeSnapName(self._snap_id)
 
     def _makeBookmarkName(self, i):
-        return self._name + '#bmark' + bytes(i)
+        return '%s#bmark%d' % (self._name, i)
 
     def getBookmark(self):
         self._bmark_id += 1
@@ -3623,12 +3957,12 @@ class _Filesystem(object):
 
     def _makeTooLongName(self, too_long_component):
         if too_long_component:
-            return 'x' * (lzc.MAXNAMELEN + 1)
+            return _TOO_LONG_PADDING
 
         # Note that another character is used for one of '/', '@', '#'.
         comp_len = lzc.MAXNAMELEN - len(self._name)
         if comp_len > 0:
-            return 'x' * comp_len
+            return _TOO_LONG_PADDING[:comp_len]
         else:
             return 'x'
 
@@ -3641,30 +3975,5 @@ class _Filesystem(object):
     def getTooLongBookmark(self, too_long_component):
         return self._name + '#' + self._makeTooLongName(too_long_component)
 
-    def _visitFilesystems(self, visitor):
-        for child in self._children:
-            child._visitFilesystems(visitor)
-        visitor(self)
-
-    def visitFilesystems(self, visitor):
-        def _fsVisitor(fs):
-            visitor(fs._name)
-
-        self._visitFilesystems(_fsVisitor)
-
-    def visitSnaps(self, visitor):
-        def _snapVisitor(fs):
-            for i in range(1, fs._snap_id + 1):
-                visitor(fs._makeSnapName(i))
-
-        self._visitFilesystems(_snapVisitor)
-
-    def visitBookmarks(self, visitor):
-        def _bmarkVisitor(fs):
-            for i in range(1, fs._bmark_id + 1):
-                visitor(fs._makeBookmarkName(i))
-
-        self._visitFilesystems(_bmarkVisitor)
-
 
 # vim: softtabstop=4 tabstop=4 expandtab shiftwidth=4